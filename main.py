@@ -1,13 +1,20 @@
 from fastapi import FastAPI, HTTPException, File, UploadFile, Form
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi import Request
 from pydantic import BaseModel
 from utils.email_processor import process_email, get_abvrs, update_audiences_using_added_cohort
-from utils.helper import get_forecast_data, get_cohorts
-from utils.audience_selector import refresh_audience_embeddings, get_selected_audience_data_by_name
-from typing import Dict, Any, List
+from utils.helper import get_forecast_data, get_forecast_data_for_demographics, get_cohorts
+from utils.audience_selector import refresh_audience_embeddings, get_selected_audience_data_by_name, get_audience_index, get_audience_index_status, get_query_cache_stats, get_storage_mode_report
+from utils.model_registry import warmup_model, is_model_loaded
+from utils.audience_catalog import audience_catalog
+from utils.cohort_catalog import cohort_catalog
+from utils.similarity_based_rag import location_group_cache
+from utils.location_gazetteer import location_gazetteer
+from utils.forecast_cache import forecast_cache
+from utils.http_client import http_client
+from typing import Dict, Any, List, Optional
 import logging
 from logging.handlers import TimedRotatingFileHandler
 from dotenv import load_dotenv
@@ -67,6 +74,15 @@ def setup_logging():
         'utils.audience_selector': logging.INFO,
         'utils.email_processor': logging.INFO,
         'utils.similarity_based_rag': logging.INFO,
+        'utils.audience_index': logging.INFO,
+        'utils.embedding_store': logging.INFO,
+        'utils.ann_index': logging.INFO,
+        'utils.model_registry': logging.INFO,
+        'utils.audience_catalog': logging.INFO,
+        'utils.cohort_catalog': logging.INFO,
+        'utils.location_gazetteer': logging.INFO,
+        'utils.forecast_cache': logging.INFO,
+        'utils.http_client': logging.INFO,
         'schedulers.scheduler': logging.INFO,
         'apscheduler': logging.WARNING,  # Reduce scheduler noise
         'sqlalchemy': logging.WARNING,  # If using SQLAlchemy
@@ -101,17 +117,38 @@ async def start_scheduler():
     """Start the scheduler when the FastAPI app starts"""
     scheduler.start()
 
+def warmup():
+    """Load the embedding model and the audience index"""
+    try:
+        warmup_model()
+        get_audience_index()
+        logger.info("Warmup completed, worker is ready")
+    except Exception as e:
+        logger.error(f"Warmup failed: {e}", exc_info=True)
+
+# Startup event to warm up the model and audience index
+@app.on_event("startup")
+async def warmup_on_startup():
+    """Warm up in the background so startup is not blocked; /ready reports when it is done"""
+    loop = asyncio.get_running_loop()
+    loop.run_in_executor(executor, warmup)
+
 # Shutdown event to stop the scheduler
 @app.on_event("shutdown")
 async def stop_scheduler():
     """Stop the scheduler when the FastAPI app shuts down"""
     scheduler.stop()
+    forecast_cache.persist()
     
 # Add a global variable to track background tasks
 background_tasks = {}
 tasks_lock = Lock()
 executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
 
+class DemographicTarget(BaseModel):
+    target_gender: str
+    target_age: str
+
 class ForecastRequest(BaseModel):
     preset: List[str]
     creative_size: str
@@ -121,6 +158,9 @@ class ForecastRequest(BaseModel):
     abvrs: List[str]
     target_gender: str
     target_age: str
+    # Extra demographic targets answered from the same upstream forecasts; when set the
+    # response is {"forecast": <preset map>, "demographics": [{target_gender, target_age, forecast}]}
+    demographics: Optional[List[DemographicTarget]] = None
 
 class AudienceSegmentRequest(BaseModel):
     name: str
@@ -148,6 +188,45 @@ async def get_scheduler_status():
         logger.error(f"Error getting scheduler status: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/ready")
+async def readiness():
+    """Readiness probe: ready only once the embedding model and audience index are loaded"""
+    status = {
+        "model_loaded": is_model_loaded(),
+        "audience_index": get_audience_index_status()
+    }
+    ready = status["model_loaded"] and status["audience_index"] is not None
+    return JSONResponse(status_code=200 if ready else 503, content={"ready": ready, **status})
+
+@app.get("/upstream-stats")
+async def get_upstream_stats():
+    """Get per-host traffic, latency and connection pool usage of upstream calls"""
+    return http_client.status()
+
+@app.get("/cache-stats")
+async def get_cache_stats():
+    """Get size and hit rates of the in-process caches"""
+    return {
+        "query_embeddings": get_query_cache_stats(),
+        "audience_catalog": audience_catalog.status(),
+        "cohort_catalog": cohort_catalog.status(),
+        "location_groups": location_group_cache.status(),
+        "location_gazetteer": location_gazetteer.status(),
+        "forecasts": forecast_cache.status()
+    }
+
+@app.get("/audience-index/storage-report")
+async def get_audience_index_storage_report():
+    """Compare float32, float16 and int8 storage of the audience index"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, get_storage_mode_report)
+
+@app.post("/location-groups/invalidate")
+async def invalidate_location_groups():
+    """Drop the cached location groups after they were edited"""
+    location_group_cache.invalidate()
+    return {"message": "Location groups cache invalidated"}
+
 @app.get("/trigger-scheduled-refresh")
 async def trigger_scheduled_refresh():
     """Manually trigger the audience embedding refresh job"""
@@ -265,7 +344,19 @@ async def get_forecast_endpoint(forecast_request: ForecastRequest) -> Dict[str,
         abvrs_limited = abvr_set[:200]
         abvrs = ",".join(abvrs_limited)
         
-        result = get_forecast_data(abvrs, forecast_request.locations, forecast_request.preset, forecast_request.creative_size, forecast_request.device_category, forecast_request.duration, forecast_request.target_gender, forecast_request.target_age)
+        if forecast_request.demographics:
+            demographics = [(forecast_request.target_gender, forecast_request.target_age)] + [(target.target_gender, target.target_age) for target in forecast_request.demographics]
+            results = get_forecast_data_for_demographics(abvrs, forecast_request.locations, forecast_request.preset, forecast_request.creative_size, forecast_request.device_category, forecast_request.duration, demographics)
+            # Separate envelope: the plain response is a preset map and every key in it is read as a preset
+            result = {
+                "forecast": results[0],
+                "demographics": [
+                    {"target_gender": gender, "target_age": age, "forecast": forecast}
+                    for (gender, age), forecast in zip(demographics[1:], results[1:])
+                ]
+            }
+        else:
+            result = get_forecast_data(abvrs, forecast_request.locations, forecast_request.preset, forecast_request.creative_size, forecast_request.device_category, forecast_request.duration, forecast_request.target_gender, forecast_request.target_age)
         logger.info(f"Process forecast result: {result}")
         if "error" in result:
             raise HTTPException(status_code=400, detail=result["error"])
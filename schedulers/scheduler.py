@@ -1,7 +1,9 @@
 import logging
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
-from utils.audience_selector import refresh_audience_embeddings
+from apscheduler.triggers.interval import IntervalTrigger
+from utils.audience_selector import refresh_audience_embeddings, get_audience_index_status, get_embedding_run_status
+from utils.forecast_cache import forecast_cache
 import asyncio
 import concurrent.futures
 
@@ -19,11 +21,19 @@ class AudienceEmbeddingScheduler:
         # Add scheduled job for audience embedding refresh
         self.scheduler.add_job(
             self._scheduled_refresh_audience_embeddings,
-            CronTrigger(day_of_week='sun', hour=6, minute=0),  # Every Sunday at 6:00 AM
+            CronTrigger(minute=0),  # Every hour; only new or changed audiences are re-embedded
             id='refresh_audience_embeddings',
-            name='Refresh Audience Embeddings Weekly',
+            name='Refresh Audience Embeddings Hourly',
             replace_existing=True
         )
+        if forecast_cache.path:
+            self.scheduler.add_job(
+                self._scheduled_persist_forecast_cache,
+                IntervalTrigger(seconds=forecast_cache.persist_interval),
+                id='persist_forecast_cache',
+                name='Persist Forecast Cache',
+                replace_existing=True
+            )
         logger.info("Scheduled jobs configured")
     
     async def _scheduled_refresh_audience_embeddings(self):
@@ -40,12 +50,20 @@ class AudienceEmbeddingScheduler:
         except Exception as e:
             logger.error(f"Error in scheduled audience embedding refresh: {e}")
     
+    async def _scheduled_persist_forecast_cache(self):
+        """Scheduled job to write the forecast cache to disk off the request path"""
+        try:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, forecast_cache.persist)
+        except Exception as e:
+            logger.error(f"Error in scheduled forecast cache persist: {e}")
+    
     def start(self):
         """Start the scheduler"""
         try:
             self.scheduler.start()
             logger.info("Scheduler started successfully")
-            logger.info("Audience embedding refresh scheduled for every Sunday at 6:00 AM")
+            logger.info("Audience embedding refresh scheduled for every hour")
         except Exception as e:
             logger.error(f"Error starting scheduler: {e}")
     
@@ -71,7 +89,9 @@ class AudienceEmbeddingScheduler:
             
             return {
                 "scheduler_running": self.scheduler.running,
-                "jobs": jobs
+                "jobs": jobs,
+                "audience_index": get_audience_index_status(),
+                "last_embedding_run": get_embedding_run_status()
             }
         except Exception as e:
             logger.error(f"Error getting scheduler status: {e}")
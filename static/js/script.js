@@ -3074,6 +3074,8 @@ async function saveLocationGroup() {
         
         if (response.ok) {
             const data = await response.json();
+            // Let the server pick up the new group on the next email instead of serving its cached list
+            fetch('/location-groups/invalidate', { method: 'POST' }).catch(err => console.error('Error invalidating location groups cache:', err));
             availableLocationGroups = {...availableLocationGroups, ...formatLocationGroups(data)};
             // Close the modal
             closeAddLocationModal();
@@ -0,0 +1,144 @@
+import numpy as np
+import logging
+import os
+from utils.audience_index import normalize_rows
+
+logger = logging.getLogger(__name__)
+
+"""
+APPROXIMATE NEAREST-NEIGHBOUR BACKENDS FOR AUDIENCE RETRIEVAL
+
+Backends share one interface: top_k(query_embedding, top_k, rows) returning the same
+(row, similarity, similarity_breakdown) tuples as AudienceScorer.top_k.
+
+- exact: brute-force scoring of every row (default)
+- ivf: inverted-file index over the fused composite vector. Queries are compared
+  with the cluster centroids, the nprobe closest clusters are shortlisted and only
+  their rows are scored exactly. nprobe trades latency for recall.
+
+CONFIGURATION (environment):
+- AUDIENCE_ANN_BACKEND: "exact" or "ivf"
+- AUDIENCE_IVF_NLIST: number of clusters (default: 4 * sqrt(catalog size))
+- AUDIENCE_IVF_NPROBE: clusters scanned per query (default: 16)
+"""
+
+ANN_BACKEND = os.getenv('AUDIENCE_ANN_BACKEND', 'exact')
+IVF_NLIST = int(os.getenv('AUDIENCE_IVF_NLIST', '0'))
+IVF_NPROBE = int(os.getenv('AUDIENCE_IVF_NPROBE', '16'))
+
+
+class ExactSearch:
+    """Brute-force search over every row"""
+
+    name = "exact"
+
+    def __init__(self, scorer):
+        self.scorer = scorer
+
+    def top_k(self, query_embedding, top_k=200, rows=None, breakdown=False):
+        return self.scorer.top_k(query_embedding, top_k=top_k, rows=rows, breakdown=breakdown)
+
+
+class IVFSearch:
+    """Inverted-file index with exact re-scoring of the probed clusters"""
+
+    name = "ivf"
+
+    def __init__(self, scorer, nlist=0, nprobe=16, iterations=10, seed=0):
+        self.scorer = scorer
+        self.nprobe = nprobe
+        size = scorer.size
+        self.nlist = min(nlist or max(1, int(4 * np.sqrt(size))), max(size, 1))
+        composite = normalize_rows(scorer.fused.dequantize())
+        self.centroids, assignments = self._train(composite, iterations, seed)
+        order = np.argsort(assignments, kind="stable")
+        bounds = np.searchsorted(assignments[order], np.arange(self.nlist + 1))
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(self.nlist)]
+        logger.info(f"IVF index built with {self.nlist} lists over {size} rows (nprobe={self.nprobe})")
+
+    def _train(self, vectors, iterations, seed):
+        """Spherical k-means; returns (centroids, assignment of every vector)"""
+        rng = np.random.default_rng(seed)
+        centroids = vectors[rng.choice(len(vectors), self.nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = np.argmax(vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, vectors)
+            empty = ~sums.any(axis=1)
+            sums[empty] = centroids[empty]
+            centroids = normalize_rows(sums)
+        return centroids, np.argmax(vectors @ centroids.T, axis=1)
+
+    def candidates(self, query_embedding, rows=None, top_k=0):
+        """
+        Rows in the clusters closest to the query, optionally restricted to rows. At least
+        nprobe clusters are scanned, and more until top_k candidates are found, so a row
+        subset spread over many clusters still yields a full result.
+        """
+        query = normalize_rows(np.asarray(query_embedding).reshape(1, -1))[0]
+        order = np.argsort(-(self.centroids @ query))
+        mask = None
+        if rows is not None:
+            mask = np.zeros(self.scorer.size, dtype=bool)
+            mask[np.asarray(rows)] = True
+        found = []
+        count = 0
+        for probed, cluster in enumerate(order):
+            if probed >= self.nprobe and count >= top_k:
+                break
+            members = self.lists[cluster]
+            if mask is not None:
+                members = members[mask[members]]
+            found.append(members)
+            count += len(members)
+        return np.sort(np.concatenate(found)) if found else np.empty(0, dtype=np.int64)
+
+    def top_k(self, query_embedding, top_k=200, rows=None, breakdown=False):
+        if self.scorer.size == 0:
+            return []
+        # A subset no larger than what probing would score is cheaper to score exactly
+        if rows is not None and len(rows) <= self.nprobe * self.scorer.size / self.nlist:
+            return self.scorer.top_k(query_embedding, top_k=top_k, rows=rows, breakdown=breakdown)
+        return self.scorer.top_k(query_embedding, top_k=top_k, rows=self.candidates(query_embedding, rows, top_k), breakdown=breakdown)
+
+
+def build_search_backend(scorer, backend=ANN_BACKEND):
+    """Create the configured search backend for a scorer"""
+    if backend == "ivf" and scorer.size > 0:
+        return IVFSearch(scorer, nlist=IVF_NLIST, nprobe=IVF_NPROBE)
+    if backend not in ("exact", "ivf"):
+        logger.warning(f"Unknown ANN backend '{backend}', falling back to exact search")
+    return ExactSearch(scorer)
+
+
+def recall_at_k(backend, queries, k=200, rows=None):
+    """
+    Mean fraction of the exact top-k rows that the backend also returns in its top-k,
+    optionally within a row subset
+    """
+    exact = ExactSearch(backend.scorer)
+    recalls = []
+    for query in queries:
+        expected = {row for row, _, _ in exact.top_k(query, top_k=k, rows=rows)}
+        if not expected:
+            continue
+        found = {row for row, _, _ in backend.top_k(query, top_k=k, rows=rows)}
+        recalls.append(len(expected & found) / len(expected))
+    return float(np.mean(recalls)) if recalls else 1.0
+
+
+def sample_recall_at_k(backend, sample_size=20, k=200, seed=0, subset_fraction=None):
+    """
+    recall@k of the backend against exact search, using audience embeddings as sample queries.
+    With subset_fraction, both searches are restricted to a random subset of that share of
+    the rows, as in name and cohort searches.
+    """
+    size = backend.scorer.size
+    if size == 0:
+        return 1.0
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(size, min(sample_size, size), replace=False)
+    rows = None
+    if subset_fraction is not None:
+        rows = np.sort(rng.choice(size, max(1, int(size * subset_fraction)), replace=False))
+    return recall_at_k(backend, backend.scorer.fused.dequantize(sample), k=k, rows=rows)
@@ -0,0 +1,204 @@
+import logging
+import os
+import time
+import concurrent.futures
+from threading import Lock, Thread
+from dotenv import load_dotenv
+from utils.http_client import http_client
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+"""
+ACTIVE AUDIENCE CATALOG SNAPSHOT
+
+Shared, filtered snapshot of getActiveAuds with stale-while-revalidate semantics:
+- younger than AUDIENCE_CATALOG_TTL seconds: served as is
+- older, but younger than AUDIENCE_CATALOG_MAX_STALE seconds: served as is while one
+  background refresh runs
+- older than that (or missing): callers wait for a refresh
+
+Concurrent callers share a single in-flight refresh. Refreshes send If-None-Match /
+If-Modified-Since when the upstream returned ETag / Last-Modified, and a 304 only
+renews the snapshot age. Every new snapshot comes with an AudienceNameIndex for
+local name search.
+"""
+
+CATALOG_TTL = int(os.getenv('AUDIENCE_CATALOG_TTL', '300'))
+CATALOG_MAX_STALE = int(os.getenv('AUDIENCE_CATALOG_MAX_STALE', '3600'))
+CATALOG_TIMEOUT = int(os.getenv('AUDIENCE_CATALOG_TIMEOUT', '60'))
+
+VALID_PREFIXES = [
+    'Persona Installed App', 'Demographic', 'AST', 'User Agent',
+    'Industry Impression & Click', 'ET Money', 'User Action',
+    'In Market', 'Parent', 'MTAG', 'Interest', 'Package'
+]
+
+
+def is_selectable_audience(entry):
+    """
+    Whether an active audience from getActiveAuds can be offered for targeting
+    """
+    return (
+        entry.get('l30d_uniques', 0) > 0
+        and entry.get('audience_name')
+        and entry.get('description')
+        and (
+            entry.get('audiencePrefix') in VALID_PREFIXES
+            or entry.get('audience_name', '').startswith('Interest |')
+        )
+    )
+
+
+class AudienceNameIndex:
+    """
+    In-process substring search over audience names.
+    Queries of three or more characters are narrowed through a trigram inverted
+    index and verified with a substring test; shorter queries scan all names.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.names = [entry['name'].lower() for entry in entries]
+        postings = {}
+        for row, name in enumerate(self.names):
+            for trigram in {name[i:i + 3] for i in range(len(name) - 2)}:
+                postings.setdefault(trigram, []).append(row)
+        self.postings = postings
+
+    def search(self, text, limit=100):
+        """
+        Entries whose name contains text (case-insensitive), prefix matches first,
+        then catalog order
+        """
+        query = text.strip().lower()
+        if not query:
+            return self.entries[:limit]
+        if len(query) >= 3:
+            trigrams = {query[i:i + 3] for i in range(len(query) - 2)}
+            posting_lists = sorted((self.postings.get(trigram, []) for trigram in trigrams), key=len)
+            candidates = set(posting_lists[0])
+            for posting_list in posting_lists[1:]:
+                candidates.intersection_update(posting_list)
+                if not candidates:
+                    break
+            rows = sorted(row for row in candidates if query in self.names[row])
+        else:
+            rows = [row for row, name in enumerate(self.names) if query in name]
+        rows.sort(key=lambda row: not self.names[row].startswith(query))
+        return [self.entries[row] for row in rows[:limit]]
+
+
+class AudienceCatalogCache:
+    """Filtered getActiveAuds snapshot shared by all requests"""
+
+    def __init__(self, ttl=CATALOG_TTL, max_stale=CATALOG_MAX_STALE):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.entries = None
+        self.name_index = None
+        self.fetched_at = 0.0
+        self.etag = None
+        self.last_modified = None
+        self.stats = {"fetches": 0, "not_modified": 0, "errors": 0, "stale_served": 0}
+        self._lock = Lock()
+        self._inflight = None
+
+    def get(self, force_refresh=False):
+        """
+        Get the filtered catalog as a list of {"name", "description", "abvr"} dicts.
+        The list is shared between callers and must not be modified.
+        """
+        age = time.time() - self.fetched_at
+        if self.entries is not None and not force_refresh:
+            if age < self.ttl:
+                return self.entries
+            if age < self.max_stale:
+                self.stats["stale_served"] += 1
+                self._refresh(wait=False)
+                return self.entries
+        return self._refresh(wait=True)
+
+    def _refresh(self, wait):
+        """Start a refresh unless one is in flight; optionally wait for it"""
+        with self._lock:
+            future = self._inflight
+            if future is None:
+                future = concurrent.futures.Future()
+                self._inflight = future
+                Thread(target=self._run_refresh, args=(future,), daemon=True).start()
+        if not wait:
+            return self.entries
+        return future.result()
+
+    def _run_refresh(self, future):
+        try:
+            future.set_result(self._fetch())
+        except Exception as e:
+            self.stats["errors"] += 1
+            if self.entries is not None:
+                logger.error(f"Audience catalog refresh failed, serving snapshot from {time.ctime(self.fetched_at)}: {e}")
+                future.set_result(self.entries)
+            else:
+                future.set_exception(e)
+        finally:
+            with self._lock:
+                self._inflight = None
+
+    def _fetch(self):
+        url = f"{os.getenv('AUDIENCE_API_URL')}/getActiveAuds?text=&page_size=30000&offset=0"
+        headers = {}
+        if self.entries is not None:
+            if self.etag:
+                headers["If-None-Match"] = self.etag
+            if self.last_modified:
+                headers["If-Modified-Since"] = self.last_modified
+        start = time.perf_counter()
+        response = http_client.get(url, headers=headers, timeout=CATALOG_TIMEOUT)
+        if response.status_code == 304 and self.entries is not None:
+            self.stats["not_modified"] += 1
+            self.fetched_at = time.time()
+            logger.info("Audience catalog not modified upstream")
+            return self.entries
+        response.raise_for_status()
+        data = response.json()
+        entries = [
+            {
+                "name": entry['audience_name'].strip(),
+                "description": entry['description'].strip(),
+                "abvr": (entry.get('abvr') or '').strip()
+            }
+            for entry in data
+            if is_selectable_audience(entry)
+        ]
+        self.name_index = AudienceNameIndex(entries)
+        self.entries = entries
+        self.etag = response.headers.get("ETag")
+        self.last_modified = response.headers.get("Last-Modified")
+        self.fetched_at = time.time()
+        self.stats["fetches"] += 1
+        logger.info(f"Audience catalog refreshed: {len(entries)} of {len(data)} entries in {time.perf_counter() - start:.1f}s")
+        return entries
+
+    def search(self, text, limit=100):
+        """
+        Search the snapshot by audience name, see AudienceNameIndex.search
+        """
+        self.get()
+        return self.name_index.search(text, limit=limit)
+
+    def status(self):
+        """Snapshot age and refresh counters for monitoring"""
+        return {
+            "size": len(self.entries) if self.entries is not None else None,
+            "age_seconds": round(time.time() - self.fetched_at, 1) if self.entries is not None else None,
+            "ttl_seconds": self.ttl,
+            "max_stale_seconds": self.max_stale,
+            "etag": self.etag,
+            **self.stats
+        }
+
+
+# Global catalog instance
+audience_catalog = AudienceCatalogCache()
@@ -0,0 +1,319 @@
+import numpy as np
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Embedding strategies stored per audience, in the order they are scored
+STRATEGIES = ["embedding", "name_embedding", "desc_embedding"]
+
+# Key used for each strategy in the similarity breakdown
+BREAKDOWN_KEYS = ["combined", "name", "description"]
+
+# Per-strategy scale applied to the raw cosine similarity
+STRATEGY_SCALES = np.array([1.0, 0.8, 0.9], dtype=np.float32)
+
+# Weighted average of the scaled similarities
+STRATEGY_WEIGHTS = np.array([0.5, 0.25, 0.25], dtype=np.float32)
+
+# Supported in-memory representations of the fused audience matrix
+STORAGE_DTYPES = ["float32", "float16", "int8"]
+
+
+def normalize_rows(matrix):
+    """
+    Return a float32 copy of matrix with every row scaled to unit length
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k_indices(scores, top_k):
+    """
+    Indices of the top_k highest scores, sorted best first.
+    Uses argpartition so only the selected k entries are sorted.
+    """
+    if top_k <= 0 or len(scores) == 0:
+        return np.empty(0, dtype=np.int64)
+    if top_k < len(scores):
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def fuse_strategies(matrices):
+    """
+    Fold the weighted, scaled per-strategy cosine similarity into one composite vector per row.
+
+    The final score is linear in the normalized strategy embeddings, so
+    sum(w_i * s_i * cos(q, m_i)) / sum(w) == q_hat . sum(w_i * s_i * m_hat_i) / sum(w).
+    """
+    fused = None
+    for weight, scale, matrix in zip(STRATEGY_WEIGHTS, STRATEGY_SCALES, matrices):
+        term = normalize_rows(matrix) * (weight * scale)
+        fused = term if fused is None else fused + term
+    return fused / STRATEGY_WEIGHTS.sum()
+
+
+class CompactMatrix:
+    """
+    Row matrix stored as float32, float16 or int8 with one float32 scale per row.
+    Products are computed on float32 blocks of block_rows rows, so only one
+    dequantized block is alive at a time.
+    """
+
+    def __init__(self, matrix, dtype="float32", block_rows=4096):
+        if dtype not in STORAGE_DTYPES:
+            raise ValueError(f"Unsupported storage dtype: {dtype}")
+        matrix = np.asarray(matrix, dtype=np.float32)
+        self.dtype = dtype
+        self.block_rows = block_rows
+        self.shape = matrix.shape
+        self.scales = None
+        if dtype == "int8":
+            max_abs = np.abs(matrix).max(axis=1) if len(matrix) else np.zeros(0, dtype=np.float32)
+            self.scales = np.where(max_abs > 0, max_abs / 127.0, 1.0).astype(np.float32)
+            self.data = np.round(matrix / self.scales[:, None]).astype(np.int8)
+        else:
+            self.data = matrix.astype(dtype)
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def dequantize(self, rows=None):
+        """float32 copy of all rows or of the given rows"""
+        data = self.data if rows is None else self.data[rows]
+        matrix = data.astype(np.float32)
+        if self.scales is not None:
+            matrix *= (self.scales if rows is None else self.scales[rows])[:, None]
+        return matrix
+
+    def dot(self, vector, rows=None):
+        """matrix[rows] @ vector as float32"""
+        if self.dtype == "float32":
+            data = self.data if rows is None else self.data[rows]
+            return data @ vector
+        count = len(self) if rows is None else len(rows)
+        result = np.empty(count, dtype=np.float32)
+        for start in range(0, count, self.block_rows):
+            block = slice(start, start + self.block_rows)
+            block_rows = block if rows is None else rows[block]
+            result[block] = self.dequantize(block_rows) @ vector
+        return result
+
+
+class AudienceScorer:
+    """
+    Scores a query embedding against one fused composite vector per audience.
+    The per-strategy source matrices are only read for the similarity breakdown
+    of the returned top-k rows.
+    """
+
+    # Also serves as the search backend when AudienceIndex gets no search_factory
+    name = "exact"
+
+    def __init__(self, matrices, dtype="float32"):
+        """
+        Args:
+            matrices: One (n, dim) matrix per entry in STRATEGIES, e.g. memory-mapped store arrays.
+            dtype: Storage dtype of the fused matrix, one of STORAGE_DTYPES.
+        """
+        self.sources = matrices
+        fused = fuse_strategies(matrices) if matrices else np.zeros((0, 0), dtype=np.float32)
+        self.fused = CompactMatrix(fused, dtype=dtype)
+        self.size = len(self.fused)
+
+    def score(self, query_embedding, rows=None):
+        """
+        Score audiences against the query.
+
+        Args:
+            rows: Optional subset of rows to score; all rows are scored when None.
+
+        Returns:
+            Final similarity per row, aligned with rows.
+        """
+        query = normalize_rows(np.asarray(query_embedding).reshape(1, -1))[0]
+        return self.fused.dot(query, None if rows is None else np.asarray(rows))
+
+    def breakdown(self, query_embedding, rows):
+        """
+        Scaled per-strategy similarities for the given rows, shape (len(STRATEGIES), len(rows))
+        """
+        query = normalize_rows(np.asarray(query_embedding).reshape(1, -1))[0]
+        per_strategy = np.stack([normalize_rows(matrix[rows]) @ query for matrix in self.sources])
+        return per_strategy * STRATEGY_SCALES[:, None]
+
+    def select_top_k(self, scores, top_k=200, rows=None):
+        """
+        (row, similarity) of the best rows from a full score vector, optionally restricted to rows
+        """
+        if rows is not None:
+            rows = np.asarray(rows)
+            positions = top_k_indices(scores[rows], top_k)
+            return [(int(rows[position]), float(scores[rows[position]])) for position in positions]
+        return [(int(row), float(scores[row])) for row in top_k_indices(scores, top_k)]
+
+    def top_k(self, query_embedding, top_k=200, rows=None, breakdown=False):
+        """
+        Return the top_k matches as (row, similarity, similarity_breakdown) tuples, best first.
+        similarity_breakdown is None unless breakdown is requested.
+        """
+        if self.size == 0 or (rows is not None and len(rows) == 0):
+            return []
+        final_scores = self.score(query_embedding, rows)
+        row_ids = np.arange(self.size) if rows is None else np.asarray(rows)
+        positions = top_k_indices(final_scores, top_k)
+        top_rows = row_ids[positions]
+        breakdowns = [None] * len(top_rows)
+        if breakdown and len(top_rows):
+            per_strategy = self.breakdown(query_embedding, top_rows)
+            breakdowns = [
+                {key: float(per_strategy[i, position]) for i, key in enumerate(BREAKDOWN_KEYS)}
+                for position in range(len(top_rows))
+            ]
+        return [
+            (int(row), float(final_scores[position]), row_breakdown)
+            for row, position, row_breakdown in zip(top_rows, positions, breakdowns)
+        ]
+
+
+class AudienceIndex:
+    """
+    Immutable in-memory audience index built from an embedding store.
+
+    A new index is built for every refresh and swapped in as a whole, so readers
+    holding a reference never observe a partially built index.
+    """
+
+    def __init__(self, store, search_factory=None, dtype="float32"):
+        """
+        Args:
+            store: EmbeddingStore to build the index from.
+            dtype: Storage dtype of the fused matrix, one of STORAGE_DTYPES.
+            search_factory: Optional callable building a search backend (see utils/ann_index.py)
+                from the scorer; exact scoring is used when None.
+        """
+        self.store = store
+        self.entries = store.entries
+        self.version = store.version
+        # abvr -> row, keeping the first row if an abvr is stored twice
+        self.row_by_abvr = {}
+        for row, entry in enumerate(self.entries):
+            self.row_by_abvr.setdefault(entry["abvr"], row)
+        self.store_created_at = store.created_at
+        self.scorer = AudienceScorer([store.strategy_matrix(strategy) for strategy in STRATEGIES], dtype=dtype)
+        self.search = search_factory(self.scorer) if search_factory else self.scorer
+        self.recall_at_200 = None
+        self.subset_recall_at_200 = None
+        self.built_at = time.time()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def rows_for_abvrs(self, abvrs):
+        """Sorted rows of the index whose abvr is in abvrs, for a fancy-index gather"""
+        row_by_abvr = self.row_by_abvr
+        rows = {row_by_abvr[abvr] for abvr in abvrs if abvr in row_by_abvr}
+        return np.fromiter(sorted(rows), dtype=np.int64, count=len(rows))
+
+    def mask_for_abvrs(self, abvrs):
+        """Boolean mask over the index rows whose abvr is in abvrs"""
+        mask = np.zeros(len(self.entries), dtype=bool)
+        mask[self.rows_for_abvrs(abvrs)] = True
+        return mask
+
+    def top_k(self, query_embedding, top_k=200, rows=None, breakdown=False):
+        """
+        Top matches as entry dicts with similarity, plus similarity_breakdown when requested.
+
+        Args:
+            rows: Optional subset of rows to rank; all rows are ranked when None.
+            breakdown: Also compute the per-strategy similarities of the returned rows.
+        """
+        results = []
+        for row, similarity, similarity_breakdown in self.search.top_k(query_embedding, top_k=top_k, rows=rows, breakdown=breakdown):
+            entry = dict(self.entries[row])
+            entry["similarity"] = similarity
+            if breakdown:
+                entry["similarity_breakdown"] = similarity_breakdown
+            results.append(entry)
+        return results
+
+    def score_all(self, query_embedding):
+        """Final similarity of every row, for ranking several row groups from one scoring pass"""
+        return self.scorer.score(query_embedding)
+
+    def top_k_from_scores(self, scores, top_k=200, rows=None):
+        """Top matches as entry dicts from a score vector returned by score_all"""
+        results = []
+        for row, similarity in self.scorer.select_top_k(scores, top_k=top_k, rows=rows):
+            entry = dict(self.entries[row])
+            entry["similarity"] = similarity
+            results.append(entry)
+        return results
+
+    def status(self):
+        """Summary of the index for monitoring endpoints"""
+        return {
+            "version": self.version,
+            "size": len(self.entries),
+            "storage_dtype": self.scorer.fused.dtype,
+            "fused_bytes": self.scorer.fused.nbytes,
+            "search_backend": self.search.name,
+            "recall_at_200": self.recall_at_200,
+            "subset_recall_at_200": self.subset_recall_at_200,
+            "built_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.built_at)),
+            "store_created_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.store_created_at))
+        }
+
+
+def ranking_agreement(reference, candidate, queries, k=200):
+    """
+    Compare the rankings of two scorers over the same rows.
+
+    Returns:
+        dict with mean overlap of the top-k sets, top-1 agreement rate and the
+        maximum absolute score difference over the reference top-k.
+    """
+    overlaps, top1_matches, max_diff = [], [], 0.0
+    for query in queries:
+        expected = reference.top_k(query, top_k=k)
+        found = candidate.top_k(query, top_k=k)
+        if not expected:
+            continue
+        overlaps.append(len({row for row, _, _ in expected} & {row for row, _, _ in found}) / len(expected))
+        top1_matches.append(bool(found) and found[0][0] == expected[0][0])
+        expected_rows = np.array([row for row, _, _ in expected])
+        diffs = np.abs(reference.score(query, expected_rows) - candidate.score(query, expected_rows))
+        max_diff = max(max_diff, float(diffs.max()))
+    return {
+        "overlap_at_k": round(float(np.mean(overlaps)), 4) if overlaps else 1.0,
+        "top1_agreement": round(float(np.mean(top1_matches)), 4) if top1_matches else 1.0,
+        "max_score_diff": round(max_diff, 6),
+        "k": k
+    }
+
+
+def storage_mode_report(index, sample_size=20, k=200, seed=0):
+    """
+    Memory use and ranking agreement against float32 for every storage dtype,
+    using sample audience vectors from the index as queries.
+    """
+    reference = AudienceScorer(index.scorer.sources, dtype="float32")
+    if reference.size == 0:
+        return {}
+    rng = np.random.default_rng(seed)
+    queries = reference.fused.dequantize(rng.choice(reference.size, min(sample_size, reference.size), replace=False))
+    report = {}
+    for dtype in STORAGE_DTYPES:
+        candidate = reference if dtype == "float32" else AudienceScorer(index.scorer.sources, dtype=dtype)
+        report[dtype] = {"bytes": candidate.fused.nbytes, **ranking_agreement(reference, candidate, queries, k=k)}
+    return report
@@ -1,16 +1,21 @@
-from sentence_transformers import SentenceTransformer
 import numpy as np
-import requests
 import logging
 import json
 import os
+import time
+import hashlib
 from dotenv import load_dotenv
 from typing import List, Dict, Any, Optional
-from sklearn.metrics.pairwise import cosine_similarity
+from threading import Lock
+from cachetools import TTLCache
 import openai
-import pandas as pd
+from utils.audience_index import AudienceIndex, STRATEGIES, storage_mode_report
+from utils.cohort_catalog import cohort_catalog
+from utils.audience_catalog import audience_catalog
+from utils.model_registry import EMBEDDING_MODEL_NAME, get_model
+from utils.ann_index import build_search_backend, sample_recall_at_k
+from utils.embedding_store import DEFAULT_STORE_DIR, save_embedding_store, load_embedding_store, check_embedding_store
 
-model = SentenceTransformer("all-MiniLM-L6-v2")
 load_dotenv()
 
 # Configure Azure OpenAI
@@ -24,6 +29,41 @@ model_name = os.getenv('AZURE_OPENAI_MODEL_NAME', 'gpt-4o-mini')
 
 logger = logging.getLogger(__name__)
 
+# Embedding computation settings for the refresh pipeline
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '256'))
+EMBEDDING_POOL_WORKERS = int(os.getenv('EMBEDDING_POOL_WORKERS', '0'))
+
+# Bump whenever the strategy text templates in precompute_embeddings change;
+# a new version (or a new EMBEDDING_MODEL_NAME) forces a full embedding rebuild
+EMBEDDING_TEMPLATE_VERSION = 1
+
+# Throughput of the last embedding computation, reported by /scheduler-status
+last_embedding_run = None
+
+# In-memory representation of the fused audience matrix: float32, float16 or int8
+AUDIENCE_EMBEDDING_DTYPE = os.getenv('AUDIENCE_EMBEDDING_DTYPE', 'float32')
+
+# Final weighted query vectors keyed by normalized theme tuple
+QUERY_CACHE_SIZE = int(os.getenv('QUERY_EMBEDDING_CACHE_SIZE', '1024'))
+QUERY_CACHE_TTL = int(os.getenv('QUERY_EMBEDDING_CACHE_TTL', '3600'))
+_query_cache = TTLCache(maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+_query_cache_lock = Lock()
+query_cache_hits = 0
+query_cache_misses = 0
+
+# Full-catalog score vectors keyed by (index version, normalized theme tuple)
+_score_cache = TTLCache(maxsize=int(os.getenv('QUERY_SCORE_CACHE_SIZE', '64')), ttl=QUERY_CACHE_TTL)
+_score_cache_lock = Lock()
+
+# Index rows of the audience catalog snapshot as (index version, catalog snapshot, mask),
+# rebuilt only when the index or the snapshot is replaced
+_catalog_mask = None
+
+# Resident audience index, replaced as a whole after every refresh
+_audience_index = None
+_index_init_lock = Lock()
+_refresh_lock = Lock()
+
 """
 AUDIENCE SELECTOR WITH EMBEDDING CACHING
 
@@ -37,8 +77,8 @@ FEATURES:
 - CSV export of results
 
 CACHING:
-- First run: Computes embeddings and saves to 'audience_embeddings.csv'
-- Subsequent runs: Loads embeddings from cache (much faster)
+- First run: Computes embeddings and saves them to the 'audience_embeddings/' store
+- Subsequent runs: Memory-maps embeddings from the store (near-instant)
 - Cache is automatically invalidated if data count changes
 
 USAGE:
@@ -47,43 +87,88 @@ USAGE:
 3. Check cache: Use check_cache_validity() function
 
 CACHE FILES:
-- audience_embeddings.csv: Precomputed embeddings
+- audience_embeddings/: Precomputed embeddings (see utils/embedding_store.py)
 - audience_data.csv: Final results with similarity scores
 """
 
-def precompute_embeddings(data):
+def encode_sentences(sentences, batch_size=EMBEDDING_BATCH_SIZE, pool_workers=EMBEDDING_POOL_WORKERS):
+    """
+    Encode sentences in large batches, optionally sharded across a process pool
+    """
+    model = get_model()
+    if pool_workers > 1:
+        pool = model.start_multi_process_pool(target_devices=["cpu"] * pool_workers)
+        try:
+            return model.encode_multi_process(sentences, pool, batch_size=batch_size)
+        finally:
+            model.stop_multi_process_pool(pool)
+    return model.encode(sentences, batch_size=batch_size)
+
+def get_content_hash(entry):
+    """
+    Hash of everything that determines an audience's embeddings
+    """
+    content = "\x1f".join([entry.get('name', ''), entry.get('description', ''), str(EMBEDDING_TEMPLATE_VERSION)])
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+def precompute_embeddings(data, batch_size=EMBEDDING_BATCH_SIZE, pool_workers=EMBEDDING_POOL_WORKERS):
     """
     Enhanced embedding computation with better text preprocessing
     """
+    global last_embedding_run
+    combined_texts, name_texts, desc_texts = [], [], []
     for entry in data:
         # Create multiple text representations for better matching
         name = entry.get('name', '')
         description = entry.get('description', '')
         
         # Strategy 1: Combined text with enhanced context
-        combined_text = f"Audience segment: {name}. Description: {description}"
+        combined_texts.append(f"Audience segment: {name}. Description: {description}")
         
         # Strategy 2: Name-focused embedding
-        name_focused = f"Target audience: {name}"
+        name_texts.append(f"Target audience: {name}")
         
         # Strategy 3: Description-focused embedding
-        desc_focused = f"Audience characteristics: {description}"
-        
-        # Create embeddings for each strategy
-        combined_embedding = model.encode(combined_text)
-        name_embedding = model.encode(name_focused)
-        desc_embedding = model.encode(desc_focused)
-        
+        desc_texts.append(f"Audience characteristics: {description}")
+    
+    if not data:
+        return data
+    
+    # Encode every strategy for every audience in one batched pass
+    sentences = combined_texts + name_texts + desc_texts
+    start = time.perf_counter()
+    embeddings = encode_sentences(sentences, batch_size=batch_size, pool_workers=pool_workers)
+    elapsed = time.perf_counter() - start
+    last_embedding_run = {
+        "sentences": len(sentences),
+        "seconds": round(elapsed, 2),
+        "sentences_per_second": round(len(sentences) / elapsed, 1) if elapsed > 0 else None,
+        "batch_size": batch_size,
+        "pool_workers": pool_workers
+    }
+    logger.info(f"Encoded {len(sentences)} sentences in {elapsed:.1f}s ({last_embedding_run['sentences_per_second']} sentences/s, batch_size={batch_size}, pool_workers={pool_workers})")
+    
+    count = len(data)
+    for i, entry in enumerate(data):
         # Store all embeddings
-        entry["embedding"] = combined_embedding
-        entry["name_embedding"] = name_embedding
-        entry["desc_embedding"] = desc_embedding
+        entry["embedding"] = embeddings[i]
+        entry["name_embedding"] = embeddings[count + i]
+        entry["desc_embedding"] = embeddings[2 * count + i]
         
         # Store original text for debugging
-        entry["combined_text"] = combined_text
+        entry["combined_text"] = combined_texts[i]
+        entry["content_hash"] = get_content_hash(entry)
         
     return data
 
+def normalize_themes(targeting_themes):
+    """
+    Cache key for a list of targeting themes. The embedding model is uncased,
+    so themes are lower-cased and whitespace-collapsed; order is kept because
+    it changes the combined sentences.
+    """
+    return tuple(" ".join(theme.lower().split()) for theme in targeting_themes if theme and theme.strip())
+
 def embed_email(targeting_themes):
     """
     Create a more sophisticated embedding for email targeting themes
@@ -91,83 +176,83 @@ def embed_email(targeting_themes):
     if not targeting_themes:
         return None
     
-    # Create multiple embedding strategies and combine them
-    embeddings = []
+    global query_cache_hits, query_cache_misses
+    key = normalize_themes(targeting_themes)
+    if not key:
+        return None
+    with _query_cache_lock:
+        cached = _query_cache.get(key)
+        if cached is not None:
+            query_cache_hits += 1
+            return cached
+        query_cache_misses += 1
     
-    # Strategy 1: Combined sentence embedding
-    combined_sentence = "Audience targeting for: " + " and ".join(targeting_themes)
-    embeddings.append(model.encode(combined_sentence))
+    # Encode the normalized themes so every input sharing a key gets the same vector
+    themes = list(key)
     
+    # Create multiple embedding strategies and encode them in one batch:
+    # Strategy 1: Combined sentence embedding
+    combined_sentence = "Audience targeting for: " + " and ".join(themes)
     # Strategy 2: Individual theme embeddings (averaged)
-    individual_embeddings = [model.encode(theme) for theme in targeting_themes]
-    avg_individual = np.mean(individual_embeddings, axis=0)
-    embeddings.append(avg_individual)
-    
     # Strategy 3: Enhanced context embedding
-    enhanced_context = f"Target audience interested in {', '.join(targeting_themes)} with high purchase intent and premium preferences"
-    embeddings.append(model.encode(enhanced_context))
+    enhanced_context = f"Target audience interested in {', '.join(themes)} with high purchase intent and premium preferences"
+    encoded = get_model().encode([combined_sentence, *themes, enhanced_context])
+    
+    embeddings = [encoded[0], np.mean(encoded[1:-1], axis=0), encoded[-1]]
     
     # Combine all strategies with weighted average
     # Give more weight to combined sentence and enhanced context
     weights = [0.4, 0.3, 0.3]  # Adjust weights based on performance
     final_embedding = np.average(embeddings, axis=0, weights=weights)
+    # Cached vectors are shared between requests
+    final_embedding.flags.writeable = False
     
+    with _query_cache_lock:
+        _query_cache[key] = final_embedding
     return final_embedding
 
+def get_query_cache_stats():
+    """
+    Size and hit rate of the query embedding cache
+    """
+    with _query_cache_lock:
+        lookups = query_cache_hits + query_cache_misses
+        return {
+            "size": len(_query_cache),
+            "max_size": _query_cache.maxsize,
+            "ttl_seconds": _query_cache.ttl,
+            "hits": query_cache_hits,
+            "misses": query_cache_misses,
+            "hit_rate": round(query_cache_hits / lookups, 3) if lookups else None
+        }
 
-def get_top_matches(email_embedding, data, top_k=200):
+
+def get_top_matches(email_embedding, index, rows=None, top_k=200, debug=False):
     """
     Enhanced similarity matching using multiple embedding strategies
     """
     if email_embedding is None:
         return []
     
-    results = []
-    
-    for entry in data:
-        # Calculate similarity using multiple strategies
-        similarities = []
-        
-        # Strategy 1: Combined embedding similarity
-        combined_sim = cosine_similarity([email_embedding], [entry["embedding"]])[0][0]
-        similarities.append(combined_sim)
-        
-        # Strategy 2: Name-focused similarity
-        name_sim = cosine_similarity([email_embedding], [entry["name_embedding"]])[0][0]
-        similarities.append(name_sim * 0.8)  # Slightly lower weight for name
-        
-        # Strategy 3: Description-focused similarity
-        desc_sim = cosine_similarity([email_embedding], [entry["desc_embedding"]])[0][0]
-        similarities.append(desc_sim * 0.9)  # Slightly lower weight for description
-        
-        # Calculate weighted average similarity
-        weights = [0.5, 0.25, 0.25]  # Adjust weights based on importance
-        final_similarity = np.average(similarities, weights=weights)
-        
-        entry["similarity"] = final_similarity
-        entry["similarity_breakdown"] = {
-            "combined": similarities[0],
-            "name": similarities[1],
-            "description": similarities[2]
-        }
-        
-        results.append(entry)
-    
-    # Sort by similarity and return top results
-    sorted_results = sorted(results, key=lambda x: x["similarity"], reverse=True)
-    return sorted_results[:top_k]
+    # Score all entries at once against the fused multi-strategy vectors;
+    # the per-strategy breakdown is only computed for the top-k when debugging
+    return index.top_k(email_embedding, top_k=top_k, rows=rows, breakdown=debug)
 
-def find_relevant_entries(targeting_themes, audience_data):
+def find_relevant_entries(targeting_themes, audience_data, debug=False):
     """
-    Enhanced function to find relevant audience entries with caching
+    Enhanced function to find relevant audience entries using the resident audience index
     """
     logger.info(f"Finding relevant entries for {targeting_themes}")
     # Step 1: Filter and clean data
     filtered_audience_data = filter_and_clean_audience_data(audience_data)
     logger.info(f"Filtered data: {len(filtered_audience_data)}")
-    # Step 2: Get embeddings from cache or compute them
-    precomputed_audience_data = get_cached_or_compute_embeddings(filtered_audience_data)
-    logger.info(f"Precomputed data: {len(precomputed_audience_data)}")
+    # Step 2: Select the matching rows of the in-memory index
+    index = get_audience_index()
+    if index is None:
+        logger.error("Audience index is not available")
+        return []
+    rows = index.rows_for_abvrs(entry['abvr'] for entry in filtered_audience_data)
+    logger.info(f"Precomputed data: {len(rows)}")
     # Step 3: Create email embedding
     email_embedding = embed_email(targeting_themes)
     if email_embedding is None:
@@ -175,14 +260,104 @@ def find_relevant_entries(targeting_themes, audience_data):
         return []
     
     # Step 4: Find top matches
-    top_entries = get_top_matches(email_embedding, precomputed_audience_data, top_k=200)
+    top_entries = get_top_matches(email_embedding, index, rows=rows, top_k=200, debug=debug)
     final_entries = [{'abvr': entry['abvr'], 'name': entry['name'], 'description': entry['description'], 'similarity': entry['similarity']} for entry in top_entries]
+    if debug:
+        for final_entry, entry in zip(final_entries, top_entries):
+            final_entry['similarity_breakdown'] = entry['similarity_breakdown']
     logger.info(f"Found {len(top_entries)} entries")
     return final_entries
 
+def get_query_scores(targeting_themes, index):
+    """
+    Full-catalog similarity scores for the themes, cached per index version so that
+    re-ranking the same keywords for another row group is only a mask split
+    """
+    key = (index.version, normalize_themes(targeting_themes))
+    with _score_cache_lock:
+        scores = _score_cache.get(key)
+    if scores is not None:
+        return scores
+    email_embedding = embed_email(targeting_themes)
+    if email_embedding is None:
+        return None
+    scores = index.score_all(email_embedding)
+    scores.flags.writeable = False
+    with _score_cache_lock:
+        _score_cache[key] = scores
+    return scores
+
+def get_catalog_mask(index):
+    """
+    Boolean mask of the index rows in the audience catalog snapshot, with the entries
+    filter_and_clean_audience_data would drop left out. Cached per (index version, snapshot).
+    """
+    global _catalog_mask
+    catalog_entries = audience_catalog.get()
+    cached = _catalog_mask
+    if cached is not None and cached[0] == index.version and cached[1] is catalog_entries:
+        return cached[2]
+    mask = index.mask_for_abvrs(
+        entry['abvr'].strip() for entry in catalog_entries
+        if (entry.get('name') or '').strip() and (entry.get('description') or '').strip() and (entry.get('abvr') or '').strip()
+    )
+    mask.flags.writeable = False
+    _catalog_mask = (index.version, catalog_entries, mask)
+    return mask
+
+def get_audience_group_masks(index, cohorts=None):
+    """
+    Row masks of the "general" audiences (catalog outside the cohorts' abvrs) and the "cohort"
+    audiences (catalog inside them), the groups get_filtered_audience_data splits the catalog into
+    """
+    catalog_mask = get_catalog_mask(index)
+    cohort_mask = index.mask_for_abvrs(get_abvrs_from_cohorts(cohorts))
+    return {"general": catalog_mask & ~cohort_mask, "cohort": catalog_mask & cohort_mask}
+
+def find_relevant_entries_for_groups(targeting_themes, cohorts=None, groups=("general", "cohort"), top_k=200):
+    """
+    Rank the general and cohort audience groups for the themes. With exact search the whole
+    catalog is scored once and every group is ranked from the same scores; with an ANN backend
+    each group is searched through the backend, so recall@200 describes this path as well.
+    
+    Args:
+        targeting_themes (list): Keywords to match.
+        cohorts (list): Cohort names splitting the catalog, see get_audience_group_masks.
+        groups (tuple): Groups to rank, "general" and/or "cohort".
+    
+    Returns:
+        dict: Group name -> top entries, in the format of find_relevant_entries.
+    """
+    logger.info(f"Finding relevant entries for {targeting_themes} in groups {list(groups)}")
+    index = get_audience_index()
+    if index is None:
+        logger.error("Audience index is not available")
+        return {group: [] for group in groups}
+    # The shared score vector is exact search; with an ANN backend each group goes through it instead
+    use_backend = index.search.name != "exact"
+    if use_backend:
+        query = embed_email(targeting_themes)
+    else:
+        query = get_query_scores(targeting_themes, index)
+    if query is None:
+        logger.info("Warning: Could not create email embedding")
+        return {group: [] for group in groups}
+    
+    group_masks = get_audience_group_masks(index, cohorts)
+    results = {}
+    for group in groups:
+        mask = group_masks[group]
+        if use_backend:
+            top_entries = index.top_k(query, top_k=top_k, rows=np.flatnonzero(mask))
+        else:
+            top_entries = index.top_k_from_scores(query, top_k=top_k, rows=np.flatnonzero(mask))
+        results[group] = [{'abvr': entry['abvr'], 'name': entry['name'], 'description': entry['description'], 'similarity': entry['similarity']} for entry in top_entries]
+        logger.info(f"Found {len(top_entries)} entries for {group}")
+    return results
+
 def get_abvrs_from_cohorts(cohorts=None):
     """
-    Get abbreviations (abvrs) from given cohort names by calling an external API.
+    Get abbreviations (abvrs) from given cohort names using the shared cohort catalog.
     
     Args:
         cohorts (list): List of cohort names.
@@ -194,51 +369,17 @@ def get_abvrs_from_cohorts(cohorts=None):
         return set()
 
     try:
-        abvrs = set()
-        url = f"{os.getenv('LOCATIONS_API_URL')}/get-all-mediaplan-cohorts"
-        response = requests.get(url)
-        response.raise_for_status()  # Raises an error for non-200 status codes
-        data = response.json()
-
-        for entry in data:
-            if entry.get('name') in cohorts:
-                raw_abvrs = entry.get('abvrs', '')
-                for abvr in raw_abvrs.split(','):
-                    abvrs.add(abvr.strip())
-
-        return abvrs
+        return cohort_catalog.get_abvrs(cohorts)
     except Exception as e:
         logger.error(f"Error getting abvrs from cohorts: {e}")
         return set()  # Consistent return type
 
-def get_filtered_audience_data(cohorts=None) -> Optional[List[Dict[str, Any]]]:
+def get_filtered_audience_data(cohorts=None, force_refresh=False) -> Optional[List[Dict[str, Any]]]:
     """
-    Get audience data from AUDIENCE_API_URL and filter based on specific rules
+    Get audience data from the shared AUDIENCE_API_URL catalog snapshot, split by cohort membership
     """
     try:
-        url = f"{os.getenv('AUDIENCE_API_URL')}/getActiveAuds?text=&page_size=30000&offset=0"
-        response = requests.get(url)
-        data = response.json()
-        valid_prefixes = [
-            'Persona Installed App', 'Demographic', 'AST', 'User Agent',
-            'Industry Impression & Click', 'ET Money', 'User Action',
-            'In Market', 'Parent', 'MTAG', 'Interest', 'Package'
-        ]
-        filtered_entry = [
-            {
-                "name": entry['audience_name'],
-                "description": entry['description'],
-                "abvr": entry['abvr']
-            }
-            for entry in data
-            if entry.get('l30d_uniques', 0) > 0
-            and entry.get('audience_name')
-            and entry.get('description')
-            and (
-                entry.get('audiencePrefix') in valid_prefixes
-                or entry.get('audience_name', '').startswith('Interest |')
-            )
-        ]
+        filtered_entry = audience_catalog.get(force_refresh=force_refresh)
         cohort_abvrs = get_abvrs_from_cohorts(cohorts)
         logger.info(f"Abvrs from cohorts: {cohort_abvrs}")
         logger.info(f"Filtered entry before abvrs: {len(filtered_entry)}")
@@ -254,28 +395,17 @@ def get_filtered_audience_data(cohorts=None) -> Optional[List[Dict[str, Any]]]:
 
 def get_selected_audience_data_by_name(name="", keywords=[]) -> Optional[List[Dict[str, Any]]]:
     """
-    Get audience data from AUDIENCE_API_URL and filter based on specific rules
+    Search the shared audience catalog by comma-separated names and rank the matches by similarity
     """
     try:
         nameArray = [x.strip() for x in name.split(',')]
-        audience_data = []
+        filtered_entry = []
+        seen_abvrs = set()
         for name in nameArray:
-            url = f"{os.getenv('AUDIENCE_API_URL')}/getActiveAuds?text={name}&page_size=100&offset=0"
-            response = requests.get(url)
-            data = response.json()
-            audience_data.extend(data)
-        valid_prefixes = [
-            'Persona Installed App', 'Demographic', 'AST', 'User Agent',
-            'Industry Impression & Click', 'ET Money', 'User Action',
-            'In Market', 'Parent', 'MTAG', 'Interest', 'Package'
-        ]
-        filtered_entry = [{'abvr': entry['abvr'], 'name': entry['audience_name'], 'description': entry['description']} for entry in audience_data if entry.get('l30d_uniques', 0) > 0
-            and entry.get('audience_name')
-            and entry.get('description')
-            and (
-                entry.get('audiencePrefix') in valid_prefixes
-                or entry.get('audience_name', '').startswith('Interest |')
-            )]
+            for entry in audience_catalog.search(name, limit=100):
+                if entry['abvr'] not in seen_abvrs:
+                    seen_abvrs.add(entry['abvr'])
+                    filtered_entry.append(dict(entry))
         final_entries = find_relevant_entries(keywords, filtered_entry)
         return final_entries
 
@@ -393,28 +523,13 @@ def filter_and_clean_audience_data(data):
     logger.info(f"Filtered {len(data)} entries down to {len(filtered_data)} high-quality entries")
     return filtered_data
 
-def save_embeddings_to_csv(data, csv_path="audience_embeddings.csv"):
+def save_embeddings(data, store_dir=DEFAULT_STORE_DIR):
     """
-    Save precomputed embeddings to CSV for caching
+    Save precomputed embeddings to the binary embedding store for caching
     """
     try:
-        # Prepare data for CSV (convert numpy arrays to lists)
-        csv_data = []
-        for entry in data:
-            csv_entry = {
-                'name': entry.get('name', ''),
-                'description': entry.get('description', ''),
-                'abvr': entry.get('abvr', ''),
-                'combined_embedding': ','.join(map(str, entry.get('embedding', []))),
-                'name_embedding': ','.join(map(str, entry.get('name_embedding', []))),
-                'desc_embedding': ','.join(map(str, entry.get('desc_embedding', []))),
-                'combined_text': entry.get('combined_text', '')
-            }
-            csv_data.append(csv_entry)
-        
-        df = pd.DataFrame(csv_data)
-        df.to_csv(csv_path, index=False)
-        logger.info(f"✅ Embeddings saved to: {csv_path}")
+        version = save_embedding_store(data, store_dir, model_name=EMBEDDING_MODEL_NAME, template_version=EMBEDDING_TEMPLATE_VERSION)
+        logger.info(f"✅ Embeddings saved to: {store_dir} (version {version})")
         return True
     except Exception as e:
         logger.error(f"❌ Error saving embeddings: {e}")
@@ -422,66 +537,85 @@ def save_embeddings_to_csv(data, csv_path="audience_embeddings.csv"):
 
 def refresh_audience_embeddings():
     """
-    Refresh audience embeddings
+    Refresh audience embeddings and hot-swap the in-memory audience index.
+    Only new or changed audiences are re-embedded.
     """
-    audience_data = get_filtered_audience_data()
-    audience_embeddings = force_recompute_embeddings(audience_data)
-    return audience_embeddings
-
-def load_embeddings_from_csv(csv_path="audience_embeddings.csv"):
+    with _refresh_lock:
+        audience_data, _ = get_filtered_audience_data(force_refresh=True)
+        if audience_data is None:
+            raise RuntimeError("Could not retrieve audience data for embedding refresh")
+        # The catalog snapshot is shared and must not carry embeddings, so embed copies of its entries
+        audience_data = [dict(entry) for entry in audience_data]
+        audience_embeddings = incremental_recompute_embeddings(audience_data)
+        load_audience_index()
+        return audience_embeddings
+
+def load_audience_index(store_dir=DEFAULT_STORE_DIR, force=False):
     """
-    Load precomputed embeddings from CSV
+    Build a new audience index from the embedding store and swap it in atomically.
+    The resident index is kept when it already serves the store's version, unless forced.
     """
-    try:
-        if not os.path.exists(csv_path):
-            logger.info(f"📁 Embeddings file not found: {csv_path}")
-            return None
-        
-        df = pd.read_csv(csv_path)
-        logger.info(f"📂 Loading embeddings from: {csv_path}")
-        
-        data = []
-        for _, row in df.iterrows():
-            entry = {
-                'name': row['name'],
-                'description': row['description'],
-                'abvr': row['abvr'],
-                'embedding': np.array([float(x) for x in row['combined_embedding'].split(',')]),
-                'name_embedding': np.array([float(x) for x in row['name_embedding'].split(',')]),
-                'desc_embedding': np.array([float(x) for x in row['desc_embedding'].split(',')]),
-                'combined_text': row['combined_text']
-            }
-            data.append(entry)
-        
-        logger.info(f"✅ Loaded {len(data)} entries with embeddings")
-        return data
-    except Exception as e:
-        logger.error(f"❌ Error loading embeddings: {e}")
+    global _audience_index
+    store = load_embedding_store(store_dir)
+    if store is None:
         return None
+    resident = _audience_index
+    if not force and resident is not None and resident.version == store.version:
+        logger.info(f"Audience index version {store.version} is already resident, skipping rebuild")
+        return resident
+    logger.info(f"📂 Building audience index from: {store_dir}")
+    index = AudienceIndex(store, search_factory=build_search_backend, dtype=AUDIENCE_EMBEDDING_DTYPE)
+    if index.search.name != "exact":
+        # Verify the ANN shortlist handed to the LLM filter is not degraded
+        index.recall_at_200 = sample_recall_at_k(index.search, k=200)
+        index.subset_recall_at_200 = sample_recall_at_k(index.search, k=200, subset_fraction=0.05)
+        logger.info(f"{index.search.name} search recall@200 against exact search: {index.recall_at_200:.3f} (5% row subset: {index.subset_recall_at_200:.3f})")
+    # Single reference assignment: requests see either the old or the new index
+    _audience_index = index
+    logger.info(f"✅ Audience index version {index.version} ready with {len(index)} entries")
+    return index
+
+def get_audience_index():
+    """
+    Get the resident audience index, building it on first use
+    """
+    index = _audience_index
+    if index is not None:
+        return index
+    with _index_init_lock:
+        if _audience_index is None:
+            logger.info("🔍 Checking for cached embeddings...")
+            if load_audience_index() is None:
+                refresh_audience_embeddings()
+        return _audience_index
+
+def get_audience_index_status():
+    """
+    Version and build time of the resident audience index
+    """
+    index = _audience_index
+    return index.status() if index is not None else None
 
-def check_cache_validity(cache_file="audience_embeddings.csv"):
+def get_storage_mode_report():
     """
-    Check if the cache file exists and is valid
+    Memory use and ranking agreement against float32 for every storage dtype
     """
-    if not os.path.exists(cache_file):
-        return False, "Cache file does not exist"
-    
-    try:
-        df = pd.read_csv(cache_file)
-        if len(df) == 0:
-            return False, "Cache file is empty"
-        
-        # Check if required columns exist
-        required_columns = ['name', 'description', 'abvr', 'combined_embedding', 'name_embedding', 'desc_embedding']
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        if missing_columns:
-            return False, f"Missing columns: {missing_columns}"
-        
-        return True, f"Cache is valid with {len(df)} entries"
-    except Exception as e:
-        return False, f"Error reading cache: {e}"
+    index = get_audience_index()
+    return storage_mode_report(index) if index is not None else None
+
+def get_embedding_run_status():
+    """
+    Throughput of the last embedding computation
+    """
+    return last_embedding_run
 
-def force_recompute_embeddings(audience_data, cache_file="audience_embeddings.csv"):
+def check_cache_validity(store_dir=DEFAULT_STORE_DIR):
+    """
+    Check if the embedding store exists and is valid
+    """
+    return check_embedding_store(store_dir)
+
+def force_recompute_embeddings(audience_data, store_dir=DEFAULT_STORE_DIR):
     """
     Force recomputation of embeddings and update cache
     """
@@ -492,22 +626,41 @@ def force_recompute_embeddings(audience_data, cache_file="audience_embeddings.cs
     
     # Save to cache
     logger.info("💾 Saving embeddings to cache...")
-    save_embeddings_to_csv(computed_data, cache_file)
+    save_embeddings(computed_data, store_dir)
     
     return computed_data
 
-def get_cached_or_compute_embeddings(audience_data, cache_file="audience_embeddings.csv"):
+def incremental_recompute_embeddings(audience_data, store_dir=DEFAULT_STORE_DIR):
     """
-    Get embeddings from cache if available, otherwise compute and cache them
+    Re-embed only new or changed audiences and drop audiences that disappeared.
+    Falls back to a full recomputation when the model or text templates changed.
     """
-    logger.info("🔍 Checking for cached embeddings...")
+    store = load_embedding_store(store_dir)
+    if store is None:
+        return force_recompute_embeddings(audience_data, store_dir)
+    if store.metadata.get("model_name") != EMBEDDING_MODEL_NAME or store.metadata.get("template_version") != EMBEDDING_TEMPLATE_VERSION:
+        logger.info(f"Embedding model or template changed ({store.metadata.get('model_name')} v{store.metadata.get('template_version')}), rebuilding all embeddings")
+        return force_recompute_embeddings(audience_data, store_dir)
     
-    # Try to load from cache first
-    cached_data = load_embeddings_from_csv(cache_file)
+    cached_rows = {entry['abvr']: (row, entry.get('content_hash')) for row, entry in enumerate(store.entries)}
+    changed_entries = []
+    for entry in audience_data:
+        entry['content_hash'] = get_content_hash(entry)
+        cached = cached_rows.get(entry['abvr'])
+        if cached and cached[1] == entry['content_hash']:
+            for strategy in STRATEGIES:
+                entry[strategy] = store.strategy_matrix(strategy)[cached[0]]
+        else:
+            changed_entries.append(entry)
     
-    if cached_data is None:
-        cached_data = refresh_audience_embeddings()
-        
-    audience_abvrs = [entry['abvr'] for entry in audience_data]
-    selected_cached_data = [entry for entry in cached_data if entry['abvr'] in audience_abvrs]
-    return selected_cached_data
+    current_abvrs = {entry['abvr'] for entry in audience_data}
+    removed_count = sum(1 for abvr in cached_rows if abvr not in current_abvrs)
+    logger.info(f"Incremental refresh: {len(changed_entries)} new or changed, {removed_count} removed, {len(audience_data) - len(changed_entries)} reused")
+    if not changed_entries and removed_count == 0 and len(audience_data) == len(store):
+        logger.info("Embeddings are up to date, keeping the current store")
+        return audience_data
+    
+    precompute_embeddings(changed_entries)
+    logger.info("💾 Saving embeddings to cache...")
+    save_embeddings(audience_data, store_dir)
+    return audience_data
@@ -0,0 +1,124 @@
+import logging
+import os
+import time
+from threading import Lock
+from dotenv import load_dotenv
+from utils.http_client import http_client
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+"""
+MEDIAPLAN COHORT CATALOG
+
+Single TTL-refreshed copy of /get-all-mediaplan-cohorts shared by helper.get_cohorts and
+audience_selector.get_abvrs_from_cohorts. The comma-separated abvrs are parsed once per
+refresh into name -> abvr set and abvr -> cohort names maps.
+
+While a refresh is running, callers are served the current snapshot instead of waiting
+for it. A failed refresh is not retried for COHORT_CATALOG_RETRY_AFTER seconds; until the
+first load succeeds lookups raise immediately.
+"""
+
+COHORT_CATALOG_TTL = int(os.getenv('COHORT_CATALOG_TTL', '300'))
+COHORT_CATALOG_TIMEOUT = int(os.getenv('COHORT_CATALOG_TIMEOUT', '30'))
+COHORT_CATALOG_RETRY_AFTER = int(os.getenv('COHORT_CATALOG_RETRY_AFTER', '60'))
+
+
+class CohortCatalog:
+    """Parsed mediaplan cohorts with TTL refresh"""
+
+    def __init__(self, ttl=COHORT_CATALOG_TTL, retry_after=COHORT_CATALOG_RETRY_AFTER):
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self.failed_at = 0.0
+        self.cohorts = None
+        self.abvrs_by_name = {}
+        self.cohorts_by_abvr = {}
+        self.fetched_at = 0.0
+        self._lock = Lock()
+
+    def _is_usable(self):
+        """Whether the current state can be served without trying a refresh"""
+        now = time.time()
+        if self.cohorts is not None and now - self.fetched_at < self.ttl:
+            return True
+        if now - self.failed_at < self.retry_after:
+            if self.cohorts is None:
+                raise RuntimeError(f"Cohort catalog load failed {now - self.failed_at:.0f}s ago")
+            return True
+        return False
+
+    def _ensure_fresh(self):
+        if self._is_usable():
+            return
+        # With a snapshot to serve, only one caller refreshes and the others do not wait for it
+        if not self._lock.acquire(blocking=self.cohorts is None):
+            return
+        try:
+            if self._is_usable():
+                return
+            try:
+                self._fetch()
+            except Exception as e:
+                self.failed_at = time.time()
+                if self.cohorts is None:
+                    raise
+                logger.error(f"Cohort catalog refresh failed, serving snapshot from {time.ctime(self.fetched_at)}: {e}")
+        finally:
+            self._lock.release()
+
+    def _fetch(self):
+        response = http_client.get(f"{os.getenv('PROD_API_URL')}/get-all-mediaplan-cohorts", timeout=COHORT_CATALOG_TIMEOUT)
+        response.raise_for_status()
+        cohorts = {}
+        abvrs_by_name = {}
+        cohorts_by_abvr = {}
+        for cohort in response.json():
+            cohort_name = cohort['name']
+            cohort_abvrs = cohort.get('abvrs') or ''
+            abvr_set = frozenset(abvr.strip() for abvr in cohort_abvrs.split(',') if abvr.strip())
+            cohorts[cohort_name] = {
+                'id': cohort['id'],
+                'abvrs': cohort_abvrs
+            }
+            abvrs_by_name[cohort_name] = abvr_set
+            for abvr in abvr_set:
+                cohorts_by_abvr.setdefault(abvr, set()).add(cohort_name)
+        # Replace all maps together so readers see one consistent snapshot
+        self.cohorts, self.abvrs_by_name, self.cohorts_by_abvr = cohorts, abvrs_by_name, cohorts_by_abvr
+        self.fetched_at = time.time()
+        logger.info(f"Cohort catalog refreshed with {len(cohorts)} cohorts")
+
+    def get_cohorts(self):
+        """Cohort name -> {'id', 'abvrs'} with abvrs as the raw comma-separated string"""
+        self._ensure_fresh()
+        return self.cohorts
+
+    def get_abvrs(self, cohort_names):
+        """Union of the abvrs of the given cohorts"""
+        self._ensure_fresh()
+        abvrs_by_name = self.abvrs_by_name
+        abvrs = set()
+        for name in cohort_names:
+            abvrs.update(abvrs_by_name.get(name, ()))
+        return abvrs
+
+    def get_cohorts_for_abvr(self, abvr):
+        """Names of the cohorts containing abvr"""
+        self._ensure_fresh()
+        return set(self.cohorts_by_abvr.get(abvr, ()))
+
+    def status(self):
+        """Catalog age for monitoring"""
+        return {
+            "size": len(self.cohorts) if self.cohorts is not None else None,
+            "age_seconds": round(time.time() - self.fetched_at, 1) if self.cohorts is not None else None,
+            "ttl_seconds": self.ttl,
+            "last_failed_at": time.ctime(self.failed_at) if self.failed_at else None
+        }
+
+
+# Global cohort catalog instance
+cohort_catalog = CohortCatalog()
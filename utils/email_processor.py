@@ -3,7 +3,7 @@ import os
 import json
 from dotenv import load_dotenv
 from utils.helper import get_cohorts, parse_locations_dict
-from utils.audience_selector import get_relevant_keywords, get_filtered_audience_data, check_cache_validity, find_relevant_entries
+from utils.audience_selector import get_relevant_keywords, get_filtered_audience_data, get_audience_index_status, find_relevant_entries_for_groups
 from utils.file_processor import FileProcessor
 import logging
 from typing import Any, List
@@ -235,9 +235,9 @@ def get_abvrs(email_subject, email_body, cohorts=[], keywords_array=None):
 
     logger.info(f"Loaded {len(all_audience_data)} audience entries")
 
-    # Check cache status
-    cache_valid, cache_message = check_cache_validity()
-    logger.info(f"Cache status: {cache_message}")
+    # Resident index status; validating the store on disk would re-read its metadata on every request
+    index_status = get_audience_index_status()
+    logger.info(f"Audience index: {index_status}" if index_status else "Audience index not loaded")
 
     if keywords_array is None:
         response = get_relevant_keywords(email_subject, email_body)
@@ -251,8 +251,9 @@ def get_abvrs(email_subject, email_body, cohorts=[], keywords_array=None):
 
     # Find relevant entries (will use cache if available)
     logger.info(f"\nFinding relevant entries...")
-    results = find_relevant_entries(keywords_array, all_audience_data)
-    sorted_cohort_entries = find_relevant_entries(keywords_array, cohort_audience_data)
+    grouped_results = find_relevant_entries_for_groups(keywords_array, cohorts)
+    results = grouped_results["general"]
+    sorted_cohort_entries = grouped_results["cohort"]
     logger.info(f"Results: {len(results)}")
     if not results:
         logger.info("Warning: No relevant entries found")
@@ -273,7 +274,7 @@ def update_audiences_using_added_cohort(cohorts=[], keywords_array=None):
 
     # Find relevant entries (will use cache if available)
     logger.info(f"\nFinding relevant entries...")
-    sorted_cohort_entries = find_relevant_entries(keywords_array, cohort_audience_data)
+    sorted_cohort_entries = find_relevant_entries_for_groups(keywords_array, cohorts, groups=("cohort",))["cohort"]
     logger.info(f"Results: {len(sorted_cohort_entries)}")
     return sorted_cohort_entries
 
@@ -0,0 +1,196 @@
+import numpy as np
+import logging
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from utils.audience_index import STRATEGIES
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+"""
+BINARY AUDIENCE EMBEDDING STORE
+
+Layout of a store directory:
+- metadata.json: format version, store version, embedding model and prompt template version,
+  shape and per-row abvr/name/description/content_hash
+- embeddings-<version>.npy: float32 array of shape (len(STRATEGIES), count, dim)
+
+metadata.json is replaced atomically after its .npy file is fully written, so readers
+always see a consistent pair. Each save writes a new .npy file instead of overwriting
+the old one, which keeps memory maps held by running workers valid.
+
+Every uvicorn worker runs its own scheduler, so saves from several processes can overlap:
+writers are serialized with an exclusive lock on .store.lock, and a save keeps the array
+of the store it replaces so a worker that has just read the old metadata can still open it.
+"""
+
+FORMAT_VERSION = 2
+DEFAULT_STORE_DIR = "audience_embeddings"
+METADATA_FILE = "metadata.json"
+LOCK_FILE = ".store.lock"
+
+
+class EmbeddingStore:
+    """Memory-mapped audience embeddings plus their metadata"""
+
+    def __init__(self, metadata, embeddings):
+        self.metadata = metadata
+        self.entries = metadata["entries"]
+        self.embeddings = embeddings
+        self.version = metadata["version"]
+        self.created_at = metadata["created_at"]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def strategy_matrix(self, strategy):
+        """(count, dim) matrix for one of STRATEGIES"""
+        return self.embeddings[STRATEGIES.index(strategy)]
+
+
+def _read_metadata(store_dir):
+    with open(os.path.join(store_dir, METADATA_FILE), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _read_npy_header(path):
+    """Return (shape, dtype) from a .npy header without reading the array"""
+    with open(path, "rb") as f:
+        major, _ = np.lib.format.read_magic(f)
+        if major == 1:
+            shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+    return shape, dtype
+
+
+@contextmanager
+def _writer_lock(store_dir):
+    """Exclusive lock across processes writing to store_dir"""
+    with open(os.path.join(store_dir, LOCK_FILE), "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _remove_stale_arrays(store_dir, keep):
+    for file_name in os.listdir(store_dir):
+        if file_name.startswith("embeddings-") and file_name.endswith(".npy") and file_name not in keep:
+            try:
+                os.remove(os.path.join(store_dir, file_name))
+            except OSError as e:
+                logger.warning(f"Could not remove stale embedding file {file_name}: {e}")
+
+
+def save_embedding_store(data, store_dir=DEFAULT_STORE_DIR, model_name=None, template_version=None):
+    """
+    Write audience entries with precomputed embeddings to a new store version
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    embeddings = np.stack([
+        np.stack([np.asarray(entry[strategy], dtype=np.float32) for entry in data])
+        for strategy in STRATEGIES
+    ]) if data else np.zeros((len(STRATEGIES), 0, 0), dtype=np.float32)
+
+    version = time.strftime("%Y%m%d%H%M%S") + f"-{uuid.uuid4().hex[:8]}"
+    array_file = f"embeddings-{version}.npy"
+
+    metadata = {
+        "format_version": FORMAT_VERSION,
+        "version": version,
+        "created_at": time.time(),
+        "model_name": model_name,
+        "template_version": template_version,
+        "array_file": array_file,
+        "strategies": STRATEGIES,
+        "count": int(embeddings.shape[1]),
+        "dim": int(embeddings.shape[2]),
+        "entries": [
+            {
+                "abvr": entry.get("abvr", ""),
+                "name": entry.get("name", ""),
+                "description": entry.get("description", ""),
+                "content_hash": entry.get("content_hash")
+            }
+            for entry in data
+        ]
+    }
+    with _writer_lock(store_dir):
+        try:
+            previous_array_file = _read_metadata(store_dir).get("array_file")
+        except (OSError, ValueError):
+            previous_array_file = None
+        np.save(os.path.join(store_dir, array_file), embeddings)
+        tmp_path = os.path.join(store_dir, f"{METADATA_FILE}.{version}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(metadata, f)
+        os.replace(tmp_path, os.path.join(store_dir, METADATA_FILE))
+        _remove_stale_arrays(store_dir, keep={array_file, previous_array_file})
+    return version
+
+
+def load_embedding_store(store_dir=DEFAULT_STORE_DIR):
+    """
+    Open the store read-only with the embeddings memory-mapped, or None if it is missing/invalid
+    """
+    if not os.path.exists(os.path.join(store_dir, METADATA_FILE)):
+        logger.info("📁 Embedding store unavailable: Embedding store does not exist")
+        return None
+    try:
+        metadata = _read_metadata(store_dir)
+    except Exception as e:
+        logger.info(f"📁 Embedding store unavailable: Error reading embedding store: {e}")
+        return None
+    is_valid, message = _check_metadata(store_dir, metadata)
+    if not is_valid:
+        logger.info(f"📁 Embedding store unavailable: {message}")
+        return None
+    embeddings = np.load(os.path.join(store_dir, metadata["array_file"]), mmap_mode="r")
+    return EmbeddingStore(metadata, embeddings)
+
+
+def check_embedding_store(store_dir=DEFAULT_STORE_DIR):
+    """
+    Validate the store from metadata.json and the .npy header only
+    """
+    if not os.path.exists(os.path.join(store_dir, METADATA_FILE)):
+        return False, "Embedding store does not exist"
+    try:
+        metadata = _read_metadata(store_dir)
+    except Exception as e:
+        return False, f"Error reading embedding store: {e}"
+    return _check_metadata(store_dir, metadata)
+
+
+def _check_metadata(store_dir, metadata):
+    """Validate already-read metadata against the .npy header"""
+    try:
+        if metadata.get("format_version") != FORMAT_VERSION:
+            return False, f"Unsupported store format: {metadata.get('format_version')}"
+        if metadata.get("strategies") != STRATEGIES:
+            return False, f"Strategy mismatch: {metadata.get('strategies')}"
+        array_path = os.path.join(store_dir, metadata["array_file"])
+        if not os.path.exists(array_path):
+            return False, f"Embedding array missing: {metadata['array_file']}"
+        shape, dtype = _read_npy_header(array_path)
+        expected_shape = (len(STRATEGIES), metadata["count"], metadata["dim"])
+        if tuple(shape) != expected_shape or dtype != np.float32:
+            return False, f"Embedding array has shape {shape} {dtype}, expected {expected_shape} float32"
+        if len(metadata["entries"]) != metadata["count"]:
+            return False, "Metadata entry count does not match embeddings"
+        if metadata["count"] == 0:
+            return False, "Embedding store is empty"
+        return True, f"Embedding store is valid with {metadata['count']} entries (version {metadata['version']})"
+    except Exception as e:
+        return False, f"Error reading embedding store: {e}"
@@ -0,0 +1,147 @@
+import json
+import hashlib
+import logging
+import os
+import time
+import uuid
+from datetime import date
+from threading import Lock
+from cachetools import LRUCache
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+"""
+UPSTREAM FORECAST RESULT CACHE
+
+Successful /forecast responses, unscaled, keyed on the sha256 of helper.forecast_query_key
+(sorted abvrs, location ids, sizes and devices, preset, geo-wise flag and date window).
+The date window in the key is at day granularity, and every entry also records the day it
+was fetched: entries from a previous day are dropped on lookup and on load, so the cache
+turns over at midnight together with the forecast window.
+
+- memory bound: LRU over the JSON size of the responses (FORECAST_CACHE_MAX_BYTES)
+- persistence: when FORECAST_CACHE_PATH is set the cache is loaded from it at startup and
+  written back atomically by a scheduler job every FORECAST_CACHE_PERSIST_INTERVAL seconds
+  and on shutdown, never on the request path. Each write uses its own temporary file, so
+  uvicorn workers sharing the path cannot interleave their writes.
+"""
+
+FORECAST_CACHE_MAX_BYTES = int(os.getenv('FORECAST_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+FORECAST_CACHE_PATH = os.getenv('FORECAST_CACHE_PATH', '')
+FORECAST_CACHE_PERSIST_INTERVAL = int(os.getenv('FORECAST_CACHE_PERSIST_INTERVAL', '60'))
+
+
+def entry_size(entry):
+    return len(entry["raw"])
+
+
+class ForecastCache:
+    """Memory-bounded LRU of unscaled forecast responses for the current day"""
+
+    def __init__(self, max_bytes=FORECAST_CACHE_MAX_BYTES, path=FORECAST_CACHE_PATH, persist_interval=FORECAST_CACHE_PERSIST_INTERVAL):
+        self.max_bytes = max_bytes
+        self.path = path
+        self.persist_interval = persist_interval
+        self.entries = LRUCache(maxsize=max_bytes, getsizeof=entry_size)
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "stores": 0}
+        self.persisted_at = time.time()
+        self._dirty = False
+        self._lock = Lock()
+        self._persist_lock = Lock()
+        if path:
+            self.load()
+
+    @staticmethod
+    def make_key(query_key):
+        return hashlib.sha256(query_key.encode("utf-8")).hexdigest()
+
+    def get(self, query_key):
+        """Cached response for a canonical query key, or None"""
+        key = self.make_key(query_key)
+        today = date.today().isoformat()
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry["day"] != today:
+                del self.entries[key]
+                self.stats["expired"] += 1
+                entry = None
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+        return json.loads(entry["raw"])
+
+    def put(self, query_key, data):
+        """Store a successful response; responses larger than the whole cache are skipped"""
+        entry = {"day": date.today().isoformat(), "raw": json.dumps(data)}
+        if entry_size(entry) > self.max_bytes:
+            return
+        with self._lock:
+            self.entries[self.make_key(query_key)] = entry
+            self.stats["stores"] += 1
+            self._dirty = True
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self._dirty = True
+
+    def load(self):
+        """Load today's entries from the persistence file, if there is one"""
+        try:
+            with open(self.path) as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.error(f"Error loading forecast cache from {self.path}: {e}")
+            return
+        today = date.today().isoformat()
+        with self._lock:
+            for key, entry in stored.items():
+                if entry.get("day") == today and entry_size(entry) <= self.max_bytes:
+                    self.entries[key] = entry
+        logger.info(f"Loaded {len(self.entries)} of {len(stored)} forecast cache entries from {self.path}")
+
+    def persist(self):
+        """Write the cache to the persistence file with an atomic replace"""
+        if not self.path:
+            return
+        with self._persist_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                snapshot = dict(self.entries.items())
+                self._dirty = False
+            tmp_path = f"{self.path}.{os.getpid()}-{uuid.uuid4().hex[:8]}.tmp"
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                with open(tmp_path, "w") as f:
+                    json.dump(snapshot, f)
+                os.replace(tmp_path, self.path)
+                self.persisted_at = time.time()
+                logger.info(f"Persisted {len(snapshot)} forecast cache entries to {self.path}")
+            except Exception as e:
+                self._dirty = True
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                logger.error(f"Error persisting forecast cache to {self.path}: {e}")
+
+    def status(self):
+        """Cache size and hit/miss counters for monitoring"""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "size": len(self.entries),
+            "bytes": self.entries.currsize,
+            "max_bytes": self.max_bytes,
+            "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else None,
+            "persistence_path": self.path or None,
+            **self.stats
+        }
+
+
+# Global forecast cache instance
+forecast_cache = ForecastCache()
@@ -1,51 +1,68 @@
-import requests
 import logging
 from datetime import datetime, timedelta
 import os
 from dotenv import load_dotenv
 from typing import List, Dict, Any, Optional, Tuple
-from utils.similarity_based_rag import get_location_groups, get_top_k_location_group_matches
+from utils.similarity_based_rag import get_location_groups, get_best_location_group_matches
 import copy
+import concurrent.futures
+import json
+from threading import Lock
+from utils.cohort_catalog import cohort_catalog
+from utils.location_gazetteer import location_gazetteer, format_location
+from utils.forecast_cache import forecast_cache
+from utils.http_client import http_client
 
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+LOCATION_LOOKUP_WORKERS = int(os.getenv('LOCATION_LOOKUP_WORKERS', '8'))
+FORECAST_MAX_CONCURRENCY = int(os.getenv('FORECAST_MAX_CONCURRENCY', '8'))
+FORECAST_TIMEOUT = int(os.getenv('FORECAST_TIMEOUT', '120'))
+
+# Upstream forecast calls of all requests share this pool, so FORECAST_MAX_CONCURRENCY caps them process-wide
+forecast_executor = concurrent.futures.ThreadPoolExecutor(max_workers=FORECAST_MAX_CONCURRENCY, thread_name_prefix="forecast")
+
 def get_cohorts() -> Dict[str, Dict[str, Any]]:
-    """Get list of cohorts from the API"""
+    """Get list of cohorts from the shared cohort catalog"""
     try:
-        response = requests.get(f"{os.getenv('PROD_API_URL')}/get-all-mediaplan-cohorts")
-        all_cohorts = response.json()
-        cohorts = {}
-        for cohort in all_cohorts:
-            cohort_id = cohort['id']
-            cohort_name = cohort['name']
-            cohort_abvrs = cohort['abvrs']
-            cohorts[cohort_name] = {
-                'id': cohort_id,
-                'abvrs': cohort_abvrs
-            }
-        return cohorts
+        return cohort_catalog.get_cohorts()
     except Exception as e:
         logger.error(f"Error getting cohorts: {e}", exc_info=True)
         return {}
 
 def get_location_id_for_a_single_location(location: str) -> Optional[Dict[str, Any]]:
-    url = f"{os.getenv('LOCATIONS_API_URL')}/locations?name={location}"
+    """
+    Get location id for a location from the local gazetteer. Misses are checked with the
+    locations service, which also knows locations added since the last gazetteer refresh.
+    """
+    try:
+        location_id = location_gazetteer.lookup(location)
+        if location_id:
+            return location_id
+    except Exception as e:
+        logger.error(f"Location gazetteer unavailable, looking up {location} through the locations service: {e}")
+    return fetch_location_id_for_a_single_location(location)
+
+def get_fuzzy_location_match(location: str) -> Optional[Dict[str, Any]]:
+    """Closest spelling variant of a location name in the gazetteer, for names nothing else resolved"""
+    try:
+        return location_gazetteer.fuzzy_lookup(location)
+    except Exception as e:
+        logger.error(f"Location gazetteer unavailable, no fuzzy match for {location}: {e}")
+        return None
+
+def fetch_location_id_for_a_single_location(location: str) -> Optional[Dict[str, Any]]:
+    url = f"{os.getenv('LOCATIONS_API_URL')}/locations"
     """Get location id for a location"""
     try:
-        response = requests.get(url)
+        response = http_client.get(url, params={"name": location})
         if response.status_code == 200:
             data = response.json()
             required_locations=[item for item in data if item['name']==location]
             if len(required_locations) > 0:
-                location_data = required_locations[0]
-                name = location_data['name']
-                id = location_data['locationId']
-                type = location_data['type']
-                countryCode = location_data['countryCode']
-                modified_name = f"{name},{countryCode},{type}"
-                return {"id":id,"name":modified_name}
+                return format_location(required_locations[0])
             else:
                 return None
         else:
@@ -55,10 +72,17 @@ def get_location_id_for_a_single_location(location: str) -> Optional[Dict[str, A
         logger.error(f"Error getting location id for {location}: {e}", exc_info=True)
         return None
 
-def get_forecast(abvr: str, includedLocation: List[Dict[str, Any]], excludedLocation: List[Dict[str, Any]], preset: str, sizes: List[List[int]], devices: List[Dict[str, str]], geoWiseResponse: bool, duration: int, nameAsId: str, scale: float) -> Optional[Dict[str, Any]]:
-    """Get forecast data for a cohort and locations"""
-    url = f"{os.getenv('PROD_API_URL')}/forecast?geoWiseResponse={geoWiseResponse}"
-    payload = {
+def resolve_locations(names: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+    """Look up distinct location names concurrently, at most LOCATION_LOOKUP_WORKERS at a time"""
+    distinct_names = list(dict.fromkeys(names))
+    if len(distinct_names) <= 1:
+        return {name: get_location_id_for_a_single_location(name) for name in distinct_names}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(LOCATION_LOOKUP_WORKERS, len(distinct_names))) as pool:
+        return dict(zip(distinct_names, pool.map(get_location_id_for_a_single_location, distinct_names)))
+
+def build_forecast_payload(abvr: str, includedLocation: List[Dict[str, Any]], excludedLocation: List[Dict[str, Any]], preset: str, sizes: List[List[int]], devices: List[Dict[str, str]], duration: int) -> Dict[str, Any]:
+    """Request body of the upstream /forecast call"""
+    return {
         "lineItemPriorityValue": 8,
         "creativeSize": sizes,
         "inventoryPresets": preset,
@@ -69,26 +93,129 @@ def get_forecast(abvr: str, includedLocation: List[Dict[str, Any]], excludedLoca
         "startDate": (datetime.now()+timedelta(days=1)).strftime("%d-%m-%Y 00:00:00"),
         "endDate": (datetime.now()+timedelta(days=duration)).strftime("%d-%m-%Y 23:59:59")
     }
+
+def forecast_query_key(payload: Dict[str, Any], geoWiseResponse: bool) -> str:
+    """
+    Canonical form of a forecast query: everything the upstream answer depends on, with
+    abvrs, location ids, sizes and devices as sorted sets and location names dropped
+    """
+    return json.dumps({
+        "geoWiseResponse": geoWiseResponse,
+        "lineItemPriorityValue": payload["lineItemPriorityValue"],
+        "abvrs": sorted({abvr.strip() for abvr in payload["abvr"].split(",") if abvr.strip()}),
+        "includedLocations": sorted({str(location["id"]) for location in payload["includedLocations"]}),
+        "excludedLocations": sorted({str(location["id"]) for location in payload["excludedLocations"]}),
+        "inventoryPresets": payload["inventoryPresets"],
+        "creativeSize": sorted({tuple(size) for size in payload["creativeSize"]}),
+        "deviceCategory": sorted({device["id"] for device in payload["deviceCategory"]}),
+        "startDate": payload["startDate"],
+        "endDate": payload["endDate"]
+    }, sort_keys=True)
+
+def fetch_forecast(payload: Dict[str, Any], geoWiseResponse: bool) -> Optional[Dict[str, Any]]:
+    """Unscaled upstream forecast response, or None if the upstream call failed"""
+    url = f"{os.getenv('PROD_API_URL')}/forecast?geoWiseResponse={geoWiseResponse}"
     headers = {
         "Content-Type": "application/json",
         "Accept": "application/json"
     }
     logger.info(f"payload: {payload}")
-    response = requests.post(url, json = payload, headers = headers)
+    # Forecasts are read-only queries, so failed connections are safe to retry; a read timeout
+    # means the upstream is struggling with the query and is not repeated
+    response = http_client.post(url, json = payload, headers = headers, timeout = FORECAST_TIMEOUT, idempotent = True, retry_read_timeout = False)
     if response.status_code == 200:
-        data = response.json()
-        if geoWiseResponse:
-            for key, value in data.items():
-                data[key]["user"] = round(value["user"]*scale, 2)
-                data[key]["impr"] = round(min(3*data[key]["user"], value["impr"]*scale), 2)
-            return data
-        else: 
-            userReach = data['CombinedResponse']['user']
-            impressions = data['CombinedResponse']['impr']
-        return {nameAsId: {"user": round(scale*userReach, 2), "impr": round(min(3*scale*userReach, scale*impressions), 2)}}
-    else:
-        logger.error(f"Error getting forecast data: {response.status_code} {response.text}", exc_info=True)
+        return response.json()
+    logger.error(f"Error getting forecast data: {response.status_code} {response.text}", exc_info=True)
+    return None
+
+def scale_forecast(data: Optional[Dict[str, Any]], geoWiseResponse: bool, nameAsId: str, scale: float) -> Optional[Dict[str, Any]]:
+    """Apply the demographic scale to an upstream response and key it the way get_forecast_data expects"""
+    if data is None:
         return None
+    if geoWiseResponse:
+        scaled = {}
+        for key, value in data.items():
+            user = round(value["user"]*scale, 2)
+            scaled[key] = {**value, "user": user, "impr": round(min(3*user, value["impr"]*scale), 2)}
+        return scaled
+    userReach = data['CombinedResponse']['user']
+    impressions = data['CombinedResponse']['impr']
+    return {nameAsId: {"user": round(scale*userReach, 2), "impr": round(min(3*scale*userReach, scale*impressions), 2)}}
+
+def fetch_and_cache_forecast(query_key: str, payload: Dict[str, Any], geoWiseResponse: bool) -> Optional[Dict[str, Any]]:
+    """fetch_forecast, storing successful responses in the forecast cache"""
+    data = fetch_forecast(payload, geoWiseResponse)
+    if data is not None:
+        forecast_cache.put(query_key, data)
+    return data
+
+# Upstream forecast queries currently being fetched, shared by all plans so that
+# concurrent requests for the same query wait on one call
+_inflight_forecasts = {}
+_inflight_forecasts_lock = Lock()
+
+class ForecastPlan:
+    """
+    Upstream forecast queries of one get_forecast_data call, keyed by forecast_query_key.
+    Queries are answered from the forecast cache when possible; identical queries within
+    the plan, or already in flight for another plan, share one upstream call. Answers
+    derived locally are counted as well.
+    """
+
+    def __init__(self, executor: concurrent.futures.Executor):
+        self.executor = executor
+        self.futures = {}
+        self.requested = 0
+        self.joined = 0
+        self.cached = 0
+        self.derived = 0
+
+    def submit(self, abvr: str, includedLocation: List[Dict[str, Any]], excludedLocation: List[Dict[str, Any]], preset: str, sizes: List[List[int]], devices: List[Dict[str, str]], geoWiseResponse: bool, duration: int) -> concurrent.futures.Future:
+        """Future of the unscaled response for a query, reusing an identical planned or in-flight query"""
+        self.requested += 1
+        payload = build_forecast_payload(abvr, includedLocation, excludedLocation, preset, sizes, devices, duration)
+        key = forecast_query_key(payload, geoWiseResponse)
+        if key in self.futures:
+            return self.futures[key]
+        data = forecast_cache.get(key)
+        if data is not None:
+            self.cached += 1
+            future = concurrent.futures.Future()
+            future.set_result(data)
+            self.futures[key] = future
+            return future
+        with _inflight_forecasts_lock:
+            future = _inflight_forecasts.get(key)
+            started = future is None
+            if started:
+                future = self.executor.submit(fetch_and_cache_forecast, key, payload, geoWiseResponse)
+                _inflight_forecasts[key] = future
+            else:
+                self.joined += 1
+        self.futures[key] = future
+        if started:
+            # Outside the lock: the callback runs immediately if the call already finished
+            future.add_done_callback(lambda _, key=key: _release_inflight_forecast(key))
+        return future
+
+    def derive(self):
+        """Record a query answered from another response instead of upstream"""
+        self.requested += 1
+        self.derived += 1
+
+    def log_summary(self):
+        upstream = len(self.futures) - self.joined - self.cached
+        logger.info(f"Forecast plan: {self.requested} queries, {upstream} upstream calls, {self.requested - upstream} saved ({self.requested - len(self.futures) - self.derived} duplicates, {self.cached} cached, {self.joined} joined in flight, {self.derived} derived)")
+
+def _release_inflight_forecast(key: str):
+    with _inflight_forecasts_lock:
+        _inflight_forecasts.pop(key, None)
+
+class LocationGroupPlaceholder:
+    """Position in parse_locations_dict output of a name still to be matched against location groups"""
+
+    def __init__(self, name: str):
+        self.name = name
 
 def parse_locations_dict(locations: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[str]]:
     """
@@ -115,12 +242,17 @@ def parse_locations_dict(locations: List[Dict[str, Any]]) -> Tuple[List[Dict[str
     parsed_locations = []
     locations_not_found=set()
     location_groups=get_location_groups()
+    # Names that are not single locations are resolved as location groups in one batch at the end;
+    # parsed_locations keeps a placeholder for each so the original order is preserved
+    possible_location_groups=[]
+    # Every name of the email is looked up concurrently up front; the branches below only read the results
+    resolved_names=resolve_locations([name for location in locations for name in location["includedLocations"]+location["excludedLocations"]])
     for location in locations:
         if len(location["excludedLocations"])==0 and len(location["includedLocations"])>=1:
             included_locations=[]
-            possible_location_groups=[]
+            unresolved_locations=[]
             for inc_location in location["includedLocations"]:
-                location_id=get_location_id_for_a_single_location(inc_location)
+                location_id=resolved_names[inc_location]
                 if location_id:
                     included_locations.append(location_id)
                     parsed_locations.append({
@@ -129,19 +261,13 @@ def parse_locations_dict(locations: List[Dict[str, Any]]) -> Tuple[List[Dict[str
                         "nameAsId": ""
                     })
                 else: 
-                    possible_location_groups.append(inc_location)
+                    unresolved_locations.append(inc_location)
             logger.info(f"included locations: in case 1: {included_locations}")
-            logger.info(f"possible groups locations: in case 1: {possible_location_groups}")
-            # get forecast for included locations
-            for possible_location in possible_location_groups:
-                location_groups_matches = get_top_k_location_group_matches(location_groups, possible_location, k=1)
-                logger.info(f"Matches: {location_groups_matches}")
-                if len(location_groups_matches)>0 and  location_groups_matches[0][1]>0.75:
-                    location_group_details=location_groups_matches[0][0]
-                    parsed_locations.append(location_group_details)
-                else:
-                    logger.info(f"No location or location group matches found for {possible_location}")
-                    locations_not_found.add(possible_location)
+            logger.info(f"possible groups locations: in case 1: {unresolved_locations}")
+            for possible_location in unresolved_locations:
+                parsed_locations.append(LocationGroupPlaceholder(possible_location))
+                if possible_location not in possible_location_groups:
+                    possible_location_groups.append(possible_location)
         elif len(location["includedLocations"])==0 and len(location["excludedLocations"])==0:
             parsed_locations.append({
                 "includedLocations": [],
@@ -154,7 +280,7 @@ def parse_locations_dict(locations: List[Dict[str, Any]]) -> Tuple[List[Dict[str
             all_locations_found = True
             logger.info(f"locations in else case: {all_locations_found}")
             for inc_location in location["includedLocations"]:
-                loc=get_location_id_for_a_single_location(inc_location)
+                loc=resolved_names[inc_location] or get_fuzzy_location_match(inc_location)
                 if loc:
                     included_locations.append(loc)
                 else:
@@ -163,7 +289,7 @@ def parse_locations_dict(locations: List[Dict[str, Any]]) -> Tuple[List[Dict[str
                     break
                         
             for exc_location in location["excludedLocations"]:
-                loc=get_location_id_for_a_single_location(exc_location)
+                loc=resolved_names[exc_location] or get_fuzzy_location_match(exc_location)
                 if loc:
                     excluded_locations.append(loc)
                 else:
@@ -179,6 +305,30 @@ def parse_locations_dict(locations: List[Dict[str, Any]]) -> Tuple[List[Dict[str
                 })
             else:
                 locations_not_found.add(location)
+    # Resolve every unresolved name against the location groups in a single pass
+    location_groups_matches = dict(zip(possible_location_groups, get_best_location_group_matches(location_groups, possible_location_groups)))
+    logger.info(f"Matches: {location_groups_matches}")
+    resolved_locations = []
+    for location in parsed_locations:
+        if not isinstance(location, LocationGroupPlaceholder):
+            resolved_locations.append(location)
+            continue
+        match = location_groups_matches.get(location.name)
+        if match and match[1]>0.75:
+            resolved_locations.append(match[0])
+            continue
+        # Spelling variants of single locations are only considered once no location group matched
+        fuzzy_location = get_fuzzy_location_match(location.name)
+        if fuzzy_location:
+            resolved_locations.append({
+                "includedLocations": [fuzzy_location],
+                "excludedLocations": [],
+                "nameAsId": ""
+            })
+        else:
+            logger.info(f"No location or location group matches found for {location.name}")
+            locations_not_found.add(location.name)
+    parsed_locations = resolved_locations
     final_parsed_locations=[]
     visited_locations=set()
     for location in parsed_locations:
@@ -259,8 +409,31 @@ def get_age_scale(age: str) -> float:
 
     return round(total_scale, 3)
 
+def get_demographic_scale(gender: str, age: str) -> float:
+    """Share of an audience's reach that falls in the target gender and age"""
+    gender_scale_dict={
+        "All": 1,
+        "Male": 0.7,
+        "Female": 0.3
+    }
+    scale = 1.0
+    if gender in gender_scale_dict.keys():
+        scale*=gender_scale_dict[gender]
+    
+    age_scale=get_age_scale(age)
+    scale*=age_scale
+    return scale
+
 def get_forecast_data(audience_segment: str, locations: List[Dict[str, Any]], presets: List[str], creative_size: str, device_category: str, duration: int, gender: str, age: str) -> Dict[str, Any]:
     """Get forecast data for a cohort and locations"""
+    return get_forecast_data_for_demographics(audience_segment, locations, presets, creative_size, device_category, duration, [(gender, age)])[0]
+
+def get_forecast_data_for_demographics(audience_segment: str, locations: List[Dict[str, Any]], presets: List[str], creative_size: str, device_category: str, duration: int, demographics: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+    """
+    Get forecast data for a cohort and locations for several (gender, age) targets.
+    The upstream queries do not depend on the demographic, so they are made once and
+    every target is a local rescale of the same unscaled responses.
+    """
     creative_size_dict={
         "Banners": [[300, 200],[728, 90],[300, 600],[320, 50],[120, 600]],
         "Interstitial": [[304, 350],[320, 480],[1320, 600],[728, 500],[1320, 570],[1260, 570],[360, 480],[1, 1],[300, 250],[480, 320],[768, 1024]],
@@ -287,49 +460,57 @@ def get_forecast_data(audience_segment: str, locations: List[Dict[str, Any]], pr
         "TIL_Malayalam_Only_RNF":"Malayalam",
         "TIL_All_Languages_RNF":"All Languages"
     }
-    gender_scale_dict={
-        "All": 1,
-        "Male": 0.7,
-        "Female": 0.3
-    }
-    scale = 1.0
-    if gender in gender_scale_dict.keys():
-        scale*=gender_scale_dict[gender]
-    
-    age_scale=get_age_scale(age)
-    scale*=age_scale
-    logger.info(f"scale: {scale}")
+    scales=[get_demographic_scale(gender, age) for gender, age in demographics]
+    logger.info(f"scales: {scales}")
     devices= device_category_dict[device_category]
     size= creative_size_dict[creative_size]
     abvrs=audience_segment
-    result={}
+    results=[{} for _ in scales]
     simplified_locations,merged_included_locations, overall_found =simplify_locations(locations)
+    # Per-location and "All" calls of every preset are independent and go out together;
+    # only a preset's "Overall" call waits for them, since it covers the locations that returned a forecast
+    plan=ForecastPlan(forecast_executor)
+    location_futures={}
+    all_futures={}
     for preset in presets:
+        location_futures[preset]=[
+            (location, plan.submit(abvrs, location["includedLocations"], location["excludedLocations"], preset, size, devices, False, duration))
+            for location in simplified_locations
+        ]
+        all_futures[preset]=plan.submit(abvrs, merged_included_locations, [], preset, size, devices, True, duration)
+    overall_futures={}
+    # Unscaled responses that made it into each preset, as (data, geoWiseResponse, nameAsId)
+    responses={}
+
+    def submit_overall(preset):
+        """Collect a preset's location and All responses and submit its Overall query"""
         overall_included = set()
         overall_excluded = set()
         overall = []
-        final_response={}
-        for location in simplified_locations:
-            forecast = get_forecast(abvrs, location["includedLocations"], location["excludedLocations"], preset, size, devices, False, duration, location["nameAsId"], scale)
+        responses[preset]=[]
+        for location, future in location_futures[preset]:
+            forecast = future.result()
             logger.info(f"forecast for {location}: {forecast}")
             if forecast:
-                final_response={**final_response, **forecast}
+                responses[preset].append((forecast, False, location["nameAsId"]))
                 overall.append(location)
             else:
                 logger.info(f"Failed to get forecast for {location}")
-        forecast = get_forecast(abvrs, merged_included_locations, [], preset, size, devices, True, duration, "All", scale)
+        forecast = all_futures[preset].result()
         logger.info(f"forecast for All: {forecast}")
         if forecast:
-            final_response={**final_response, **forecast}
+            responses[preset].append((forecast, True, "All"))
             overall.append({"includedLocations": merged_included_locations, "excludedLocations": [], "nameAsId": "All"})
         else:
             logger.info(f"Failed to get forecast for All")
-            
-        logger.info(f"final_response before overall: {final_response}")
-        if len(final_response) == 1:
-            only_value = next(iter(final_response.values()))
-            logger.info(f"only_value: {only_value}: copied: {copy.deepcopy(only_value)}")
-            final_response["Overall"] = copy.deepcopy(only_value)
+
+        response_keys = set()
+        for data, geoWiseResponse, nameAsId in responses[preset]:
+            response_keys.update(data.keys() if geoWiseResponse else [nameAsId])
+        logger.info(f"response keys before overall: {response_keys}")
+        if len(response_keys) == 1:
+            # The only response is also the Overall one
+            plan.derive()
         else:
             if overall_found:
                 overall_included = set()
@@ -343,10 +524,30 @@ def get_forecast_data(audience_segment: str, locations: List[Dict[str, Any]], pr
             logger.info(f"overall_included: {overall_included}")
             logger.info(f"overall_excluded: {overall_excluded}")
             logger.info(f"overall: {overall}")
-            overall_forecast = get_forecast(abvrs, [{"id": id, "name": ""} for id in overall_included], [{"id": id, "name": ""} for id in overall_excluded], preset, size, devices, False, duration, "Overall", scale)
-            if overall_forecast:
-                final_response={**final_response, **overall_forecast}
-        result[preset_display_text[preset]]=final_response
-    logger.info(f"final_response: {result}")
-    return result
-    
\ No newline at end of file
+            overall_futures[preset] = plan.submit(abvrs, [{"id": id, "name": ""} for id in overall_included], [{"id": id, "name": ""} for id in overall_excluded], preset, size, devices, False, duration)
+    # Presets are handled in the order their calls complete, so each preset's Overall
+    # only waits on that preset's own calls
+    pending={preset: {future for _, future in location_futures[preset]} | {all_futures[preset]} for preset in presets}
+    while pending:
+        for preset in list(pending):
+            # Keep only the calls still running; wait() returns at once for a finished one
+            pending[preset]={future for future in pending[preset] if not future.done()}
+            if not pending[preset]:
+                del pending[preset]
+                submit_overall(preset)
+        if pending:
+            concurrent.futures.wait(set().union(*pending.values()), return_when=concurrent.futures.FIRST_COMPLETED)
+    for preset in presets:
+        overall_forecast = overall_futures[preset].result() if preset in overall_futures else None
+        for result, scale in zip(results, scales):
+            final_response={}
+            for data, geoWiseResponse, nameAsId in responses[preset]:
+                final_response={**final_response, **scale_forecast(data, geoWiseResponse, nameAsId, scale)}
+            if preset not in overall_futures:
+                final_response["Overall"] = copy.deepcopy(next(iter(final_response.values())))
+            elif overall_forecast:
+                final_response={**final_response, **scale_forecast(overall_forecast, False, "Overall", scale)}
+            result[preset_display_text[preset]]=final_response
+    plan.log_summary()
+    logger.info(f"final_response: {results}")
+    return results
@@ -0,0 +1,192 @@
+import requests
+import logging
+import os
+import random
+import time
+from collections import deque
+from threading import Lock, BoundedSemaphore
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+"""
+SHARED HTTP CLIENT FOR UPSTREAM SERVICES
+
+One requests.Session for every upstream call (audience, cohort, locations and forecast
+services), so connections are kept alive and reused instead of paying a TCP/TLS
+handshake per call.
+
+- per-host connection pools of HTTP_POOL_MAXSIZE connections
+- (connect, read) timeouts; a scalar timeout from a caller is its read timeout
+- retries with exponential backoff and jitter on connection errors and 429/502/503/504,
+  only for idempotent calls (GET, HEAD, OPTIONS, PUT, DELETE, or idempotent=True).
+  No retry waits longer than HTTP_MAX_RETRY_DELAY: a Retry-After beyond it returns the
+  response instead. Expensive calls pass retry_read_timeout=False so a read timeout,
+  which usually means an overloaded upstream, is not repeated.
+- at most HTTP_HOST_CONCURRENCY requests in flight per host; further callers wait
+- per-host request, retry, error, latency and pool utilisation figures in status()
+"""
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '60'))
+HTTP_POOL_CONNECTIONS = int(os.getenv('HTTP_POOL_CONNECTIONS', '8'))
+HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', '16'))
+HTTP_HOST_CONCURRENCY = int(os.getenv('HTTP_HOST_CONCURRENCY', '16'))
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '3'))
+HTTP_RETRY_BACKOFF = float(os.getenv('HTTP_RETRY_BACKOFF', '0.5'))
+HTTP_MAX_RETRY_DELAY = float(os.getenv('HTTP_MAX_RETRY_DELAY', '10'))
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+RETRY_STATUSES = {429, 502, 503, 504}
+LATENCY_WINDOW = 500
+
+
+class HostStats:
+    """Request counters and recent latencies of one upstream host"""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.waiting = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def summary(self, limit):
+        latencies = sorted(self.latencies)
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 1) if latencies else None
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "retries": self.retries,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "waiting": self.waiting,
+            "utilisation": round(self.in_flight / limit, 3),
+            "latency_ms_p50": percentile(0.5),
+            "latency_ms_p95": percentile(0.95),
+            "latency_ms_max": round(latencies[-1] * 1000, 1) if latencies else None
+        }
+
+
+class UpstreamHTTPClient:
+    """Pooled, rate-limited requests.Session shared by all upstream integrations"""
+
+    def __init__(self, host_concurrency=HTTP_HOST_CONCURRENCY, max_retries=HTTP_MAX_RETRIES, backoff=HTTP_RETRY_BACKOFF):
+        self.host_concurrency = host_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        # Retries are handled in request() so they can depend on the call being idempotent
+        self.adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=0)
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+        self.hosts = {}
+        self._lock = Lock()
+
+    def _host(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self.hosts:
+                self.hosts[host] = (BoundedSemaphore(self.host_concurrency), HostStats())
+            return self.hosts[host]
+
+    def _retry_delay(self, attempt, response=None):
+        """Seconds to wait before the next attempt, or None if the server asked for longer than HTTP_MAX_RETRY_DELAY"""
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return float(retry_after) if float(retry_after) <= HTTP_MAX_RETRY_DELAY else None
+        return min(self.backoff * (2 ** attempt) * (0.5 + random.random()), HTTP_MAX_RETRY_DELAY)
+
+    def request(self, method, url, idempotent=None, timeout=None, retry_read_timeout=True, **kwargs):
+        """
+        Send a request through the shared session. Raises like requests does once retries
+        are exhausted; a retryable status on the last attempt is returned to the caller.
+        """
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        if timeout is None:
+            timeout = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+        elif not isinstance(timeout, tuple):
+            timeout = (HTTP_CONNECT_TIMEOUT, timeout)
+        attempts = 1 + (self.max_retries if idempotent else 0)
+        semaphore, stats = self._host(url)
+        for attempt in range(attempts):
+            with self._lock:
+                stats.waiting += 1
+            semaphore.acquire()
+            with self._lock:
+                stats.waiting -= 1
+                stats.in_flight += 1
+                stats.max_in_flight = max(stats.max_in_flight, stats.in_flight)
+            start = time.perf_counter()
+            failed = True
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+                failed = response.status_code >= 500
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt + 1 >= attempts or (isinstance(e, requests.ReadTimeout) and not retry_read_timeout):
+                    raise
+                delay = self._retry_delay(attempt)
+                logger.warning(f"{method} {url} failed ({e}), retrying in {delay:.1f}s")
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt + 1 >= attempts:
+                    return response
+                delay = self._retry_delay(attempt, response)
+                if delay is None:
+                    logger.warning(f"{method} {url} returned {response.status_code} with Retry-After {response.headers.get('Retry-After')}s, not retrying")
+                    return response
+                logger.warning(f"{method} {url} returned {response.status_code}, retrying in {delay:.1f}s")
+            finally:
+                semaphore.release()
+                with self._lock:
+                    stats.in_flight -= 1
+                    stats.requests += 1
+                    stats.errors += failed
+                    stats.latencies.append(time.perf_counter() - start)
+            with self._lock:
+                stats.retries += 1
+            time.sleep(delay)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def pool_status(self):
+        """Connections opened and idle per urllib3 connection pool"""
+        pools = {}
+        container = self.adapter.poolmanager.pools
+        for key in list(container.keys()):
+            pool = container.get(key)
+            if pool is None:
+                continue
+            pools[f"{key.key_scheme}://{key.key_host}:{key.key_port}"] = {
+                "connections_opened": pool.num_connections,
+                # The pool queue is pre-filled with None placeholders for connections not opened yet
+                "idle": sum(conn is not None for conn in list(pool.pool.queue)) if pool.pool is not None else 0,
+                "maxsize": pool.pool.maxsize if pool.pool is not None else HTTP_POOL_MAXSIZE
+            }
+        return pools
+
+    def status(self):
+        """Per-host traffic, latency and pool utilisation for monitoring"""
+        with self._lock:
+            hosts = {host: stats.summary(self.host_concurrency) for host, (_, stats) in self.hosts.items()}
+        return {
+            "host_concurrency": self.host_concurrency,
+            "hosts": hosts,
+            "pools": self.pool_status()
+        }
+
+
+# Global HTTP client instance
+http_client = UpstreamHTTPClient()
@@ -0,0 +1,223 @@
+import logging
+import os
+import time
+import unicodedata
+from difflib import SequenceMatcher
+from threading import Lock
+from dotenv import load_dotenv
+from utils.http_client import http_client
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+"""
+LOCAL LOCATION GAZETTEER
+
+In-process copy of the locations service (/locations), loaded in bulk and refreshed
+every LOCATION_GAZETTEER_TTL seconds, so resolving the locations of an email does not
+cost one HTTP round trip per name.
+
+- exact index: names folded to lower case without diacritics ("São Paulo" == "sao paulo").
+  When several locations fold to the same key, one whose name matches the query exactly
+  wins, otherwise the first in service order (as the per-name endpoint did).
+- aliases: well-known renamed places ("Bengaluru" / "Bangalore") are tried in both
+  directions before fuzzy matching, since their spellings are too far apart for it.
+- fuzzy index: character trigrams over the folded names. Candidates sharing the most
+  trigrams with the query are re-ranked by SequenceMatcher ratio and accepted above
+  LOCATION_FUZZY_THRESHOLD, which catches spelling variants and typos. Candidates that
+  contain the query or are contained in it ("Canada" for "US+Canada") are never fuzzy
+  matches. Fuzzy lookup is separate from lookup() so callers can try location groups first.
+
+A failed bulk load is not retried for LOCATION_GAZETTEER_RETRY_AFTER seconds; until the
+first load succeeds lookups raise immediately so callers can fall back.
+
+Results use the shape the rest of the app expects: {"id": locationId, "name": "Name,CC,TYPE"}.
+"""
+
+LOCATION_GAZETTEER_TTL = int(os.getenv('LOCATION_GAZETTEER_TTL', '3600'))
+LOCATION_GAZETTEER_TIMEOUT = int(os.getenv('LOCATION_GAZETTEER_TIMEOUT', '60'))
+LOCATION_FUZZY_THRESHOLD = float(os.getenv('LOCATION_FUZZY_THRESHOLD', '0.8'))
+LOCATION_GAZETTEER_RETRY_AFTER = int(os.getenv('LOCATION_GAZETTEER_RETRY_AFTER', '60'))
+FUZZY_CANDIDATES = 20
+
+RENAMED_PLACES = [
+    ("bengaluru", "bangalore"), ("mumbai", "bombay"), ("chennai", "madras"),
+    ("kolkata", "calcutta"), ("gurugram", "gurgaon"), ("puducherry", "pondicherry"),
+    ("thiruvananthapuram", "trivandrum"), ("kochi", "cochin"), ("mysuru", "mysore"),
+    ("prayagraj", "allahabad"), ("vadodara", "baroda"), ("varanasi", "benares")
+]
+ALIASES = {}
+for _current, _former in RENAMED_PLACES:
+    ALIASES.setdefault(_current, []).append(_former)
+    ALIASES.setdefault(_former, []).append(_current)
+
+
+def fold_name(name):
+    """Lower-case, strip diacritics and collapse whitespace"""
+    decomposed = unicodedata.normalize('NFKD', name)
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(stripped.casefold().split())
+
+
+def name_trigrams(folded):
+    padded = f"  {folded} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def format_location(location):
+    """Location from the locations service in the {"id", "name": "Name,CC,TYPE"} shape"""
+    return {
+        "id": location['locationId'],
+        "name": f"{location['name']},{location['countryCode']},{location['type']}"
+    }
+
+
+class GazetteerSnapshot:
+    """One load of /locations with its exact and trigram indexes, never modified after creation"""
+
+    def __init__(self, locations):
+        self.locations = locations
+        self.exact = {}
+        self.folded_names = []
+        self.postings = {}
+        for row, location in enumerate(locations):
+            folded = fold_name(location['name'])
+            self.folded_names.append(folded)
+            self.exact.setdefault(folded, []).append(row)
+            for trigram in name_trigrams(folded):
+                self.postings.setdefault(trigram, []).append(row)
+
+    def __len__(self):
+        return len(self.locations)
+
+
+class LocationGazetteer:
+    """Exact and fuzzy location lookup over a TTL-refreshed copy of /locations"""
+
+    def __init__(self, ttl=LOCATION_GAZETTEER_TTL, fuzzy_threshold=LOCATION_FUZZY_THRESHOLD, retry_after=LOCATION_GAZETTEER_RETRY_AFTER):
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self.failed_at = 0.0
+        self.fuzzy_threshold = fuzzy_threshold
+        self.snapshot = None
+        self.fetched_at = 0.0
+        self.stats = {"exact_hits": 0, "fuzzy_hits": 0, "misses": 0}
+        self._lock = Lock()
+
+    def _is_usable(self):
+        """Whether the current state can be served without trying a bulk load"""
+        now = time.time()
+        if self.snapshot is not None and now - self.fetched_at < self.ttl:
+            return True
+        if now - self.failed_at < self.retry_after:
+            if self.snapshot is None:
+                raise RuntimeError(f"Location gazetteer load failed {now - self.failed_at:.0f}s ago")
+            return True
+        return False
+
+    def _ensure_fresh(self):
+        if self._is_usable():
+            return
+        with self._lock:
+            if self._is_usable():
+                return
+            try:
+                self._fetch()
+            except Exception as e:
+                self.failed_at = time.time()
+                if self.snapshot is None:
+                    raise
+                logger.error(f"Location gazetteer refresh failed, serving snapshot from {time.ctime(self.fetched_at)}: {e}")
+
+    def _fetch(self):
+        start = time.perf_counter()
+        response = http_client.get(f"{os.getenv('LOCATIONS_API_URL')}/locations", timeout=LOCATION_GAZETTEER_TIMEOUT)
+        response.raise_for_status()
+        snapshot = GazetteerSnapshot([location for location in response.json() if location.get('name')])
+        # A single assignment, so a lookup reads either the old or the new snapshot, never a mix
+        self.snapshot = snapshot
+        self.fetched_at = time.time()
+        logger.info(f"Location gazetteer refreshed: {len(snapshot)} locations in {time.perf_counter() - start:.1f}s")
+
+    def _exact_row(self, snapshot, name, folded):
+        rows = snapshot.exact.get(folded)
+        if not rows:
+            return None
+        for row in rows:
+            if snapshot.locations[row]['name'] == name:
+                return row
+        return rows[0]
+
+    def _fuzzy_row(self, snapshot, folded):
+        counts = {}
+        for trigram in name_trigrams(folded):
+            for row in snapshot.postings.get(trigram, ()):
+                counts[row] = counts.get(row, 0) + 1
+        if not counts:
+            return None
+        candidates = sorted(counts, key=lambda row: (-counts[row], row))[:FUZZY_CANDIDATES]
+        best_row, best_ratio = None, 0.0
+        for row in candidates:
+            candidate = snapshot.folded_names[row]
+            # Containment means a different, larger or smaller place (or a group), not a misspelling
+            if folded in candidate or candidate in folded:
+                continue
+            ratio = SequenceMatcher(None, folded, candidate).ratio()
+            if ratio > best_ratio:
+                best_row, best_ratio = row, ratio
+        if best_ratio <= self.fuzzy_threshold:
+            return None
+        logger.info(f"Fuzzy location match: '{folded}' -> '{snapshot.locations[best_row]['name']}' ({best_ratio:.2f})")
+        return best_row
+
+    def lookup(self, name):
+        """
+        Resolve a location name to {"id", "name": "Name,CC,TYPE"} by exact or alias match,
+        or None if there is none. Raises if the gazetteer is not loaded.
+        """
+        self._ensure_fresh()
+        snapshot = self.snapshot
+        folded = fold_name(name)
+        if not folded:
+            return None
+        row = self._exact_row(snapshot, name, folded)
+        for alias in ALIASES.get(folded, ()):
+            if row is not None:
+                break
+            row = self._exact_row(snapshot, name, alias)
+        if row is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["exact_hits"] += 1
+        return format_location(snapshot.locations[row])
+
+    def fuzzy_lookup(self, name):
+        """
+        Resolve a location name to its closest spelling variant, or None.
+        Raises if the gazetteer is not loaded.
+        """
+        self._ensure_fresh()
+        snapshot = self.snapshot
+        folded = fold_name(name)
+        row = self._fuzzy_row(snapshot, folded) if folded else None
+        if row is None:
+            return None
+        self.stats["fuzzy_hits"] += 1
+        return format_location(snapshot.locations[row])
+
+    def status(self):
+        """Gazetteer age and lookup counters for monitoring"""
+        snapshot = self.snapshot
+        return {
+            "size": len(snapshot) if snapshot is not None else None,
+            "age_seconds": round(time.time() - self.fetched_at, 1) if snapshot is not None else None,
+            "ttl_seconds": self.ttl,
+            "fuzzy_threshold": self.fuzzy_threshold,
+            "last_failed_at": time.ctime(self.failed_at) if self.failed_at else None,
+            **self.stats
+        }
+
+
+# Global gazetteer instance
+location_gazetteer = LocationGazetteer()
@@ -0,0 +1,49 @@
+import logging
+import time
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+"""
+SHARED SENTENCE-TRANSFORMER REGISTRY
+
+One instance per model name per process, loaded on first use or during warmup,
+and shared by utils/audience_selector.py and utils/similarity_based_rag.py.
+"""
+
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+
+_models = {}
+_models_lock = Lock()
+
+
+def get_model(name=EMBEDDING_MODEL_NAME):
+    """
+    Get the shared SentenceTransformer, loading it on first use
+    """
+    model = _models.get(name)
+    if model is not None:
+        return model
+    with _models_lock:
+        if name not in _models:
+            # Imported here so importing the app does not pay for loading torch
+            from sentence_transformers import SentenceTransformer
+            start = time.perf_counter()
+            _models[name] = SentenceTransformer(name)
+            logger.info(f"Loaded embedding model {name} in {time.perf_counter() - start:.1f}s")
+        return _models[name]
+
+
+def warmup_model(name=EMBEDDING_MODEL_NAME):
+    """
+    Load the model and run one encode so the first request does not pay for lazy initialization
+    """
+    get_model(name).encode(["warmup"])
+    logger.info(f"Embedding model {name} warmed up")
+
+
+def is_model_loaded(name=EMBEDDING_MODEL_NAME):
+    """
+    Whether the model has been loaded in this process
+    """
+    return name in _models
@@ -1,26 +1,58 @@
-from sentence_transformers import SentenceTransformer, util
-import requests
+import numpy as np
 import os
-model = SentenceTransformer("all-MiniLM-L6-v2")
-
-def get_top_k_location_group_matches(location_groups_details, query, k=5):
-    location_embeddings={
-        key: model.encode(key, convert_to_tensor=True)
-        for key in location_groups_details.keys()
-    }
-    query_embedding = model.encode(query, convert_to_tensor=True)
-    scores = [
-        (name, float(util.pytorch_cos_sim(query_embedding, emb)))
-        for name, emb in location_embeddings.items()
-    ]
-    top_k = sorted(scores, key=lambda x: x[1], reverse=True)
-    top_k = top_k[:k]
-    return [[location_groups_details[name], score] for name, score in top_k]
+import logging
+import time
+from threading import Lock, Thread
+from utils.model_registry import get_model
+from utils.http_client import http_client
 
-def get_location_groups():
-    location_groups = {}
+logger = logging.getLogger(__name__)
+
+LOCATION_GROUPS_TTL = int(os.getenv('LOCATION_GROUPS_TTL', '600'))
+LOCATION_GROUPS_TIMEOUT = int(os.getenv('LOCATION_GROUPS_TIMEOUT', '30'))
+
+class LocationGroupMatcher:
+    """Normalized embedding matrix of location-group names, rebuilt only when the names change"""
+
+    def __init__(self):
+        self.names = ()
+        self.matrix = None
+        self._lock = Lock()
+
+    def get_matrix(self, location_groups_details):
+        """Return (names, matrix) for the current location groups, re-encoding only on change"""
+        names = tuple(location_groups_details.keys())
+        with self._lock:
+            if names != self.names or self.matrix is None:
+                self.matrix = get_model().encode(list(names), normalize_embeddings=True) if names else np.zeros((0, 0), dtype=np.float32)
+                self.names = names
+                logger.info(f"Encoded {len(names)} location group names")
+            return self.names, self.matrix
+
+# Global matcher shared by all requests
+location_group_matcher = LocationGroupMatcher()
+
+def get_best_location_group_matches(location_groups_details, queries):
+    """
+    Top-1 location group for every query, encoding all queries in one batch and
+    scoring them with one matrix-matrix product.
+
+    Returns:
+        List aligned with queries of [location_group_details, score], or None when there are no groups.
+    """
+    names, location_embeddings = location_group_matcher.get_matrix(location_groups_details)
+    if not names or not queries:
+        return [None] * len(queries)
+    query_embeddings = get_model().encode(list(queries), normalize_embeddings=True)
+    scores = query_embeddings @ location_embeddings.T
+    best = np.argmax(scores, axis=1)
+    return [[location_groups_details[names[j]], float(scores[i, j])] for i, j in enumerate(best)]
+
+def fetch_location_groups():
+    """Fetch /location-groups and reshape every group into includedLocations/excludedLocations/nameAsId"""
     url = f"{os.getenv('LOCATIONS_API_URL')}/location-groups"
-    response = requests.get(url)
+    response = http_client.get(url, timeout=LOCATION_GROUPS_TIMEOUT)
+    response.raise_for_status()
     location_groups = response.json()
     location_groups_details = {}
     for group in location_groups.keys():
@@ -39,4 +71,82 @@ def get_location_groups():
             "excludedLocations": excluded_locations_details,
             "nameAsId": group
         }
-    return location_groups_details
\ No newline at end of file
+    return location_groups_details
+
+class LocationGroupCache:
+    """
+    Reshaped location groups with a TTL. Expired groups are still served while one
+    background refresh runs; invalidate() forces the next read to fetch again.
+    Every invalidate() starts a new generation, and a refresh that started in an older
+    generation does not store its result, so pre-edit groups cannot come back.
+    """
+
+    def __init__(self, ttl=LOCATION_GROUPS_TTL):
+        self.ttl = ttl
+        self.groups = None
+        self.fetched_at = 0.0
+        self.generation = 0
+        self._lock = Lock()
+        self._load_lock = Lock()
+        self._refreshing = False
+
+    def get(self):
+        groups = self.groups
+        if groups is None:
+            with self._load_lock:
+                groups = self.groups
+                if groups is None:
+                    groups = self._refresh()
+        elif time.time() - self.fetched_at >= self.ttl:
+            with self._lock:
+                start_refresh = not self._refreshing
+                self._refreshing = True
+            if start_refresh:
+                Thread(target=self._background_refresh, daemon=True).start()
+        return groups
+
+    def _refresh(self):
+        """Fetch the groups and store them unless the cache was invalidated meanwhile"""
+        with self._lock:
+            generation = self.generation
+        groups = fetch_location_groups()
+        with self._lock:
+            if generation != self.generation:
+                logger.info("Location groups changed during refresh, discarding the fetched groups")
+                return groups
+            self.groups = groups
+            self.fetched_at = time.time()
+        logger.info(f"Location groups refreshed: {len(groups)} groups")
+        return groups
+
+    def _background_refresh(self):
+        try:
+            self._refresh()
+        except Exception as e:
+            logger.error(f"Location group refresh failed, serving groups from {time.ctime(self.fetched_at)}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def invalidate(self):
+        """Drop the cached groups so edits made in the UI are visible on the next read"""
+        with self._lock:
+            self.generation += 1
+            self.groups = None
+            self.fetched_at = 0.0
+        logger.info("Location groups cache invalidated")
+
+    def status(self):
+        groups = self.groups
+        return {
+            "size": len(groups) if groups is not None else None,
+            "age_seconds": round(time.time() - self.fetched_at, 1) if groups is not None else None,
+            "ttl_seconds": self.ttl,
+            "generation": self.generation
+        }
+
+# Global location group cache
+location_group_cache = LocationGroupCache()
+
+def get_location_groups():
+    return location_group_cache.get()